@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+# compares the checksum engine of syslbuild with the old single thread sha256 implementation
+# usage: python3 benchmarks/hash_benchmark.py [files count] [max file size]
+import sys
+import os
+import time
+import random
+import hashlib
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import syslbuild
+
+def legacy_file_checksum(file_path):
+    h = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(8192), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def legacy_dir_checksum(dir_path):
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(dir_path):
+        for name in sorted(files):
+            file_path = os.path.join(root, name)
+            h.update(file_path.encode())
+            h.update(legacy_file_checksum(file_path).encode())
+    return h.hexdigest()
+
+def makeTree(path, filesCount, maxFileSize):
+    rnd = random.Random(0)
+    for i in range(filesCount):
+        dirPath = os.path.join(path, f"d{i % 100}", f"s{i % 7}")
+        os.makedirs(dirPath, exist_ok=True)
+        with open(os.path.join(dirPath, f"f{i}"), "wb") as f:
+            f.write(rnd.randbytes(rnd.randint(0, maxFileSize)))
+
+def measure(name, func):
+    syslbuild.fileChecksumCache.clear()
+    syslbuild.fileChecksumCacheNew.clear()
+    startTime = time.time()
+    func()
+    print(f"{name:<32} {time.time() - startTime:8.2f}s")
+
+def main():
+    filesCount = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    maxFileSize = int(sys.argv[2]) if len(sys.argv) > 2 else 256 * 1024
+
+    with tempfile.TemporaryDirectory() as path:
+        print(f"creating {filesCount} files in {path}")
+        makeTree(path, filesCount, maxFileSize)
+
+        measure("legacy sha256 (1 thread)", lambda: legacy_dir_checksum(path))
+        for algo in ("sha256", "blake2b") + (("blake3",) if syslbuild.blake3 else ()):
+            measure(f"syslbuild {algo}", lambda: syslbuild.get_dir_checksum(path, algo))
+
+if __name__ == "__main__":
+    main()
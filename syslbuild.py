@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 import sys
 import json5
+import json
 import argparse
 import subprocess
 import os
@@ -12,15 +13,47 @@ import math
 import re
 import hashlib
 import urllib.parse
+import urllib.request
+import urllib.error
 import platform
+import threading
+import heapq
+import traceback
+import fcntl
+import errno
+import time
+import contextlib
+import copy
+import sqlite3
+import mmap
+import concurrent.futures
+import queue
+import select
+import collections
+import atexit
+import gzip
+import shlex
+
+try:
+    import blake3
+except ImportError:
+    blake3 = None
 
 path_output = "output"
 path_temp = ".temp"
 
+# the build state. it is set from the command line or by the Build api
+architecture = None
+args = None
+log_file = None
+log_file2 = None
+
 def loadTempPaths():
     global path_temp_architecture
     global path_build
     global path_build_checksums
+    global path_build_manifests
+    global path_build_layers
     global path_temp_cache_pacman
     global path_temp_pacman_conf
     global path_temp_kernel_build
@@ -29,23 +62,115 @@ def loadTempPaths():
     global path_mount
     global path_mount2
     global path_temp_kernel_sources
+    global path_build_history
+    global path_file_hash_index
+    global path_temp_apt_archives
+    global path_temp_debian_snapshots
+    global path_temp_ccache
     
     path_temp_architecture = os.path.join(path_temp, architecture)
     os.makedirs(path_temp_architecture, exist_ok=True)
     
     path_build = os.path.join(path_temp_architecture, "build")
     path_build_checksums = os.path.join(path_temp_architecture, "build_checksums")
+    path_build_manifests = os.path.join(path_temp_architecture, "build_manifests")
+    path_build_layers = os.path.join(path_temp_architecture, "build_layers")
     path_temp_cache_pacman = os.path.join(path_temp_architecture, "pacman")
     path_temp_pacman_conf = os.path.join(path_temp_architecture, "pacman.conf")
     path_temp_kernel_build = os.path.join(path_temp_architecture, "kernel_build")
+    path_build_history = os.path.join(path_temp_architecture, "build_history.jsonl")
 
-    path_temp_temp = os.path.join(path_temp, "temp")
+    # temporary files and mount points are separate for each architecture so that architectures can be built at the same time
+    path_temp_temp = os.path.join(path_temp_architecture, "temp")
     path_logs = os.path.join(path_temp, "logs")
-    path_mount = os.path.join(path_temp, "mount")
-    path_mount2 = os.path.join(path_temp, "mount2")
+    path_mount = os.path.join(path_temp_architecture, "mount")
+    path_mount2 = os.path.join(path_temp_architecture, "mount2")
     path_temp_kernel_sources = os.path.join(path_temp, "downloaded_kernel_sources")
+    path_file_hash_index = os.path.join(path_temp, "file_hash_index.sqlite")
+    path_temp_apt_archives = os.path.join(path_temp, "apt_archives")
+    path_temp_debian_snapshots = os.path.join(path_temp, "debian_snapshots")
+    path_temp_ccache = os.path.join(path_temp, "ccache")
 
 aeval = asteval.Interpreter()
+aevalLock = threading.Lock()
+
+# state of the current builditem worker thread (only used with --jobs greater than 1)
+buildThreadContext = threading.local()
+logLock = threading.Lock()
+# the log is written by a separate thread: the files are flushed when the log is idle or every LOG_FLUSH_INTERVAL seconds, not after every line
+LOG_FLUSH_INTERVAL = 0.5
+LOG_CAPTURE_LINES = 200
+LOG_ITEM_FILES = 64
+DEFAULT_CONSOLE_LINES = 100
+logQueue = queue.SimpleQueue()
+logWriterThread = None
+namedLocks = {}
+namedLocksLock = threading.Lock()
+
+def getNamedLock(name):
+    with namedLocksLock:
+        if name not in namedLocks:
+            namedLocks[name] = threading.Lock()
+        return namedLocks[name]
+
+@contextlib.contextmanager
+def fileLock(lockPath, shared=False, blocking=True):
+    # works between builditems threads, between syslbuild processes (--parallel-arch) and between build agents on a shared directory
+    # the thread lock is needed because on NFS the file lock is held by the whole process
+    # with blocking=False, gives False instead of waiting if the lock is held by someone else
+    os.makedirs(os.path.dirname(lockPath) or ".", exist_ok=True)
+    threadLock = getNamedLock(os.path.abspath(lockPath))
+    if not threadLock.acquire(blocking):
+        yield False
+        return
+    try:
+        with open(lockPath, "a") as f:
+            try:
+                fcntl.flock(f, (fcntl.LOCK_SH if shared else fcntl.LOCK_EX) | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+    finally:
+        threadLock.release()
+
+# callback of the Build api: buildEventCallback(eventName, data). it can be called from builditems threads
+buildEventCallback = None
+
+def emitBuildEvent(eventName, **data):
+    if buildEventCallback:
+        buildEventCallback(eventName, data)
+
+# parsed json files are kept for the entire lifetime of the process (useful for the Build api)
+parsedJsonCache = {}
+parsedJsonCacheLock = threading.Lock()
+
+def loadJsonFile(path):
+    path = os.path.abspath(path)
+    stat_result = os.stat(path)
+    fileStamp = (stat_result.st_mtime_ns, stat_result.st_size)
+
+    with parsedJsonCacheLock:
+        cached = parsedJsonCache.get(path)
+        if cached is None or cached[0] != fileStamp:
+            with open(path, "r", encoding="utf-8") as f:
+                cached = (fileStamp, json5.load(f))
+            parsedJsonCache[path] = cached
+
+    # builditems are modified during preparation, so the cache must not be shared
+    return copy.deepcopy(cached[1])
+
+def getWorkerName():
+    return getattr(buildThreadContext, "workerName", None)
+
+def getWorkerPath(path):
+    workerName = getWorkerName()
+    if workerName is None:
+        return path
+    return os.path.join(path, workerName)
 
 DEFAULT_RIGHTS = [0, 0, "0000"]
 DEFAULT_RIGHTS_0755 = [0, 0, "0755"]
@@ -106,19 +231,152 @@ def pathConcat(*paths):
 def buildLog(logstr, quiet=False):
     if not quiet:
         logstr = f"-------- SYSLBUILD: {logstr}"
+
+    itemName = getattr(buildThreadContext, "itemName", None)
+    if itemName is not None:
+        logstr = f"[{itemName}] {logstr}"
     
-    print(logstr)
+    if logWriterThread is None:
+        startLogWriter()
+    logQueue.put((logstr, itemName, None))
+
+    emitBuildEvent("log", line=logstr)
+
+def startLogWriter():
+    global logWriterThread
+    with logLock:
+        if logWriterThread is None:
+            logWriterThread = threading.Thread(target=runLogWriter, name="syslbuild log", daemon=True)
+            logWriterThread.start()
+            atexit.register(flushBuildLog, True)
+
+def flushBuildLog(closeItemLogs=False):
+    # waits until everything logged before the call is written to the console and the log files
+    if logWriterThread is None or threading.current_thread() is logWriterThread:
+        return
+
+    done = threading.Event()
+    logQueue.put((None, None, (done, closeItemLogs)))
+    done.wait()
+
+def getItemLogFile(itemLogFiles, itemName):
+    # the log of every builditem is also written to a separate file next to the build log
+    if not log_file:
+        return None
 
-    log_file.write(logstr + "\n")
-    log_file.flush()
+    key = (log_file.name, itemName)
+    itemLogFile = itemLogFiles.get(key)
+    if itemLogFile is None:
+        if len(itemLogFiles) >= LOG_ITEM_FILES:
+            itemLogFiles.popitem(last=False)[1].close()
+        path = os.path.join(os.path.splitext(log_file.name)[0], itemName.replace("/", "_") + ".log")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        itemLogFile = open(path, "a")
+        itemLogFiles[key] = itemLogFile
+    else:
+        itemLogFiles.move_to_end(key)
+    return itemLogFile
+
+def flushLogFiles(itemLogFiles, closeItemLogs):
+    for logFile in [log_file, log_file2] + list(itemLogFiles.values()):
+        if logFile:
+            logFile.flush()
+
+    if closeItemLogs:
+        for itemLogFile in itemLogFiles.values():
+            itemLogFile.close()
+        itemLogFiles.clear()
+
+def runLogWriter():
+    itemLogFiles = collections.OrderedDict()
+    consoleWindow = 0
+    consoleLines = 0
+    consoleSkipped = 0
+    lastFlush = time.monotonic()
+
+    def consoleSkippedLine():
+        return f"-------- SYSLBUILD: {consoleSkipped} lines of the commands output are not shown in the console, they are in the log file\n"
+
+    while True:
+        try:
+            batch = [logQueue.get(timeout=LOG_FLUSH_INTERVAL)]
+        except queue.Empty:
+            # the log is idle
+            if consoleSkipped:
+                sys.stdout.write(consoleSkippedLine())
+                sys.stdout.flush()
+                consoleSkipped = 0
+            flushLogFiles(itemLogFiles, False)
+            lastFlush = time.monotonic()
+            continue
+
+        try:
+            while len(batch) < 4096:
+                batch.append(logQueue.get_nowait())
+        except queue.Empty:
+            pass
 
-    if log_file2:
-        log_file2.write(logstr + "\n")
-        log_file2.flush()
+        consoleLimit = args.console_lines if args else 0
+        console = []
+        for logstr, itemName, flushRequest in batch:
+            try:
+                if flushRequest:
+                    if consoleSkipped:
+                        console.append(consoleSkippedLine())
+                        consoleSkipped = 0
+                    sys.stdout.write("".join(console))
+                    sys.stdout.flush()
+                    console = []
+                    flushLogFiles(itemLogFiles, flushRequest[1])
+                    lastFlush = time.monotonic()
+                    flushRequest[0].set()
+                    continue
+
+                line = logstr + "\n"
+                if log_file:
+                    log_file.write(line)
+                if log_file2:
+                    log_file2.write(line)
+                if itemName is not None:
+                    itemLogFile = getItemLogFile(itemLogFiles, itemName)
+                    if itemLogFile:
+                        itemLogFile.write(line)
+            except Exception:
+                traceback.print_exc()
+                if flushRequest:
+                    flushRequest[0].set()
+                continue
+
+            # the output of the commands is shown in the console no faster than consoleLimit lines per second, the log files get all of it
+            if consoleLimit and not "-------- SYSLBUILD: " in logstr:
+                now = time.monotonic()
+                if now - consoleWindow >= 1:
+                    if consoleSkipped:
+                        console.append(consoleSkippedLine())
+                        consoleSkipped = 0
+                    consoleWindow = now
+                    consoleLines = 0
+                if consoleLines >= consoleLimit:
+                    consoleSkipped += 1
+                    continue
+                consoleLines += 1
+            console.append(line)
+
+        if console:
+            sys.stdout.write("".join(console))
+            sys.stdout.flush()
+
+        if time.monotonic() - lastFlush >= LOG_FLUSH_INTERVAL:
+            flushLogFiles(itemLogFiles, False)
+            lastFlush = time.monotonic()
 
 def getSize(path):
     if os.path.isfile(path):
         return os.path.getsize(path)
+
+    manifest = findOutputManifest(path)
+    if manifest:
+        return manifest["size"]
     
     total = 0
     for dirpath, dirnames, filenames in os.walk(path, followlinks=False):
@@ -130,6 +388,34 @@ def getSize(path):
                 pass
     return total
 
+def getDiskUsage(path):
+    # unlike getSize, it counts the really allocated blocks and does not follow symlinks
+    if not os.path.lexists(path):
+        return 0
+
+    if not os.path.isdir(path) or os.path.islink(path):
+        return os.lstat(path).st_blocks * 512
+
+    manifest = findOutputManifest(path)
+    if manifest:
+        return manifest["diskUsage"]
+
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path, followlinks=False):
+        for name in dirnames + filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+            except FileNotFoundError:
+                pass
+    return total
+
+def formatBytes(size):
+    for unit in ["B", "KiB", "MiB", "GiB"]:
+        if size < 1024:
+            return f"{size:.1f} {unit}" if unit != "B" else f"{size} {unit}"
+        size /= 1024
+    return f"{size:.1f} TiB"
+
 def splitNumberUnit(s):
     match = re.match(r"([\d\.]+)([a-zA-Z]*)", s)
     if match:
@@ -151,7 +437,8 @@ def calcSize(sizeLitteral, folderOrFilelist=None):
                 contentSize = getSize(folderOrFilelist)
             
             evalStr = sizeLitteral.replace("auto", str(contentSize))
-            result = aeval(evalStr)
+            with aevalLock:
+                result = aeval(evalStr)
             return math.ceil(result)
         else:
             return 0
@@ -177,7 +464,36 @@ def getLogFile():
     filepath = pathConcat(path_logs, filename)
 
     print(f"Log path: {filepath}")
-    return open(filepath, "w")
+    logFile = open(filepath, "w")
+    # the log is locked while it is written, so that other syslbuild processes do not compress it
+    fcntl.flock(logFile, fcntl.LOCK_SH)
+
+    if args and args.compress_logs:
+        compressOldLogs()
+    return logFile
+
+def compressOldLogs():
+    # the logs of the previous builds (and their builditems logs) are compressed with gzip
+    for name in sorted(os.listdir(path_logs)):
+        logPath = os.path.join(path_logs, name)
+        if not name.endswith(".log") or not os.path.isfile(logPath):
+            continue
+
+        with open(logPath, "rb") as f:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                continue
+
+            paths = [logPath]
+            itemLogsPath = os.path.splitext(logPath)[0]
+            if os.path.isdir(itemLogsPath):
+                paths += [os.path.join(itemLogsPath, itemLogName) for itemLogName in sorted(os.listdir(itemLogsPath)) if itemLogName.endswith(".log")]
+
+            for path in paths:
+                with open(path, "rb") as logFile, gzip.open(path + ".gz", "wb") as compressedFile:
+                    shutil.copyfileobj(logFile, compressedFile, 1024 * 1024)
+                os.remove(path)
 
 def readBool(tbl, name):
     if name in tbl:
@@ -231,8 +547,9 @@ def deleteAny(path):
         os.remove(path)
 
 def getTempPath(subpath):
-    os.makedirs(path_temp_temp, exist_ok=True)
-    return pathConcat(path_temp_temp, subpath)
+    tempPath = getWorkerPath(path_temp_temp)
+    os.makedirs(tempPath, exist_ok=True)
+    return pathConcat(tempPath, subpath)
 
 def getTempFolder(subdirectory):
     path = getTempPath(subdirectory)
@@ -240,7 +557,124 @@ def getTempFolder(subdirectory):
     os.makedirs(path, exist_ok=True)
     return path
 
+# the builditems that only change a copy of another builditem (smart-chroot, directory starting with ["item", "."], etc.)
+# mount overlayfs in place of their result: the source builditem is the read-only lower layer, only the changes are stored (.temp/ARCHITECTURE/build_layers)
+# for the other builditems the result looks like a normal directory, the layers are "flattened" when the result is packed or copied
+# the layers are mounted when the result is used for the first time and are unmounted at the end of the build
+mountedLayers = {}
+layersLock = threading.RLock()
+
+def getItemLayerPath(itemName):
+    return pathConcat(path_build_layers, normalizeItemReference(itemName))
+
+def getLayerOutputName(outputPath):
+    # the name of the not exported result that is stored as a layer, otherwise None
+    outputPath = os.path.abspath(outputPath)
+    buildPath = os.path.abspath(path_build)
+    if not outputPath.startswith(buildPath + os.sep):
+        return None
+    outputName = os.path.relpath(outputPath, buildPath)
+    if os.path.isfile(pathConcat(getItemLayerPath(outputName), "layer.json")):
+        return outputName
+    return None
+
+def mountLayer(mergedPath, lowerPath, layerPath):
+    upperPath = os.path.abspath(pathConcat(layerPath, "upper"))
+    workPath = os.path.abspath(pathConcat(layerPath, "work"))
+    os.makedirs(upperPath, exist_ok=True)
+    os.makedirs(workPath, exist_ok=True)
+    os.makedirs(mergedPath, exist_ok=True)
+
+    # the root of the result gets the owner and rights of the source, as with cp -a
+    lower_stat = os.stat(lowerPath)
+    os.chown(upperPath, lower_stat.st_uid, lower_stat.st_gid)
+    os.chmod(upperPath, stat.S_IMODE(lower_stat.st_mode))
+
+    buildExecute(["mount", "-t", "overlay", "overlay", "-o", f"lowerdir={os.path.abspath(lowerPath)},upperdir={upperPath},workdir={workPath}", mergedPath], False)
+    if not os.path.ismount(mergedPath):
+        return False
+    mountedLayers[os.path.abspath(mergedPath)] = os.path.abspath(lowerPath)
+    return True
+
+def umountLayer(mergedPath):
+    mergedPath = os.path.abspath(mergedPath)
+    with layersLock:
+        # the layers that use this result as the lower layer are unmounted first
+        for otherMergedPath, lowerPath in list(mountedLayers.items()):
+            if lowerPath == mergedPath or lowerPath.startswith(mergedPath + os.sep):
+                umountLayer(otherMergedPath)
+        if os.path.ismount(mergedPath):
+            buildExecute(["umount", mergedPath])
+        mountedLayers.pop(mergedPath, None)
+
+def umountLayers():
+    with layersLock:
+        for mergedPath in sorted(mountedLayers, key=len, reverse=True):
+            umountLayer(mergedPath)
+
+def ensureItemLayersMounted(itemName):
+    reference = normalizeItemReference(itemName)
+    while reference and reference != ".":
+        layerPath = getItemLayerPath(reference)
+        metaPath = pathConcat(layerPath, "layer.json")
+        if os.path.isfile(metaPath):
+            mergedPath = os.path.abspath(pathConcat(path_build, reference))
+            with layersLock:
+                if os.path.ismount(mergedPath):
+                    return
+
+                with open(metaPath, "r", encoding="utf-8") as f:
+                    lowerPath = json.load(f)["lower"]
+
+                # the lower layer can also be a layered builditem
+                buildPath = os.path.abspath(path_build)
+                if lowerPath.startswith(buildPath + os.sep):
+                    ensureItemLayersMounted(os.path.relpath(lowerPath, buildPath))
+
+                if not os.path.isdir(lowerPath) or not mountLayer(mergedPath, lowerPath, layerPath):
+                    buildLog(f"WARNING: failed to mount the layer of the builditem \"{reference}\"")
+            return
+        reference = os.path.dirname(reference)
+
+def releaseItemLayer(item):
+    itemPath = os.path.abspath(getItemPath(item))
+    umountLayer(itemPath)
+    deleteDirectory(getItemLayerPath(item["name"]))
+
+def canUseLayer(item):
+    # the exported results must be normal directories
+    return not readBool(item, "export") and item.get("overlay", True)
+
+def getDerivedItemFolder(item, sourcePath):
+    # the result of the builditem that starts as a copy of sourcePath
+    if canUseLayer(item) and os.path.isdir(sourcePath):
+        itemPath = getItemFolder(item)
+        layerPath = getItemLayerPath(item["name"])
+        with layersLock:
+            if mountLayer(itemPath, sourcePath, layerPath):
+                with open(pathConcat(layerPath, "layer.json"), "w", encoding="utf-8") as f:
+                    json.dump({"lower": os.path.abspath(sourcePath)}, f)
+                return itemPath
+        deleteDirectory(layerPath)
+        buildLog("WARNING: failed to mount overlayfs, the source is copied")
+
+    itemPath = getItemFolder(item)
+    copyItemFiles(sourcePath, itemPath)
+    return itemPath
+
+def getTempLayerFolder(subdirectory, sourcePath):
+    # a temporary copy of sourcePath, it must be released by umountLayer
+    mergedPath = getTempFolder(subdirectory)
+    layerPath = getTempFolder(subdirectory + "_layer")
+    with layersLock:
+        if mountLayer(mergedPath, sourcePath, layerPath):
+            return mergedPath
+    buildLog("WARNING: failed to mount overlayfs, the source is copied")
+    copyItemFiles(sourcePath, mergedPath)
+    return mergedPath
+
 def findItem(itemName):
+    ensureItemLayersMounted(itemName)
     path = pathConcat(path_build, itemName)
     if os.path.exists(path):
         return path
@@ -271,12 +705,111 @@ def isUserItem(itemName):
 
     return False
 
-def buildExecute(cmd, checkValid=True, input_data=None, cwd=None):
+def recordCommandDuration(cmd, duration):
+    # the commands are collected only while the builditem is being built (see buildItem)
+    commands = getattr(buildThreadContext, "itemCommands", None)
+    if commands is not None:
+        if isinstance(cmd, list):
+            cmd = " ".join(cmd)
+        commands.append({"command": cmd[:300], "duration": round(duration, 3)})
+
+# the CPU budget of the build (--cpus) is a GNU make jobserver: a pipe with a token for every CPU
+# make takes the tokens by itself, syslbuild takes them for the other commands, so parallel builditems and kernels do not oversubscribe the machine
+# the jobserver of the parent process (syslbuild --parallel-arch or make) is used if there is one, so several processes share one budget
+jobserverLock = threading.Lock()
+jobserverPool = None
+
+def getJobserverFromEnvironment():
+    for flag in os.environ.get("MAKEFLAGS", "").split():
+        if flag.startswith("--jobserver-auth=") or flag.startswith("--jobserver-fds="):
+            auth = flag.split("=", 1)[1]
+            try:
+                if auth.startswith("fifo:"):
+                    writeFd = os.open(auth[5:], os.O_RDWR)
+                    return {"auth": auth, "cpus": None, "fds": (), "read": os.open(auth[5:], os.O_RDONLY | os.O_NONBLOCK), "write": writeFd}
+
+                readFd, writeFd = [int(fd) for fd in auth.split(",")]
+                if not stat.S_ISFIFO(os.fstat(readFd).st_mode) or not stat.S_ISFIFO(os.fstat(writeFd).st_mode):
+                    return None
+                return {"auth": auth, "cpus": None, "fds": (readFd, writeFd), "read": os.open(f"/proc/self/fd/{readFd}", os.O_RDONLY | os.O_NONBLOCK), "write": writeFd}
+            except (OSError, ValueError):
+                return None
+    return None
+
+def closeJobserver(pool):
+    for fd in set(pool["fds"]) | {pool["read"], pool["write"]}:
+        os.close(fd)
+
+def getJobserver():
+    global jobserverPool
+    with jobserverLock:
+        # the pool of this process is created again if a build of the Build api asks for another number of CPUs
+        if jobserverPool is not None and jobserverPool["cpus"] is not None and jobserverPool["cpus"] != getCpusCount():
+            closeJobserver(jobserverPool)
+            jobserverPool = None
+
+        if jobserverPool is None:
+            jobserverPool = getJobserverFromEnvironment()
+            if jobserverPool is not None:
+                buildLog(f"CPU budget: the jobserver of the parent process is used ({jobserverPool["auth"]})")
+            else:
+                readFd, writeFd = os.pipe()
+                os.write(writeFd, b"+" * getCpusCount())
+                # the tokens are taken without blocking through a separate open file description, make can change the blocking mode of its own
+                jobserverPool = {"auth": f"{readFd},{writeFd}", "cpus": getCpusCount(), "fds": (readFd, writeFd), "read": os.open(f"/proc/self/fd/{readFd}", os.O_RDONLY | os.O_NONBLOCK), "write": writeFd}
+                buildLog(f"CPU budget: {getCpusCount()} CPUs")
+        return jobserverPool
+
+def getCpusCount():
+    return getattr(args, "cpus", None) or os.cpu_count() or 1
+
+def takeJobToken(wait):
+    readFd = getJobserver()["read"]
+    while True:
+        try:
+            return os.read(readFd, 1) or None
+        except BlockingIOError:
+            if not wait:
+                return None
+            select.select([readFd], [], [])
+
+@contextlib.contextmanager
+def jobTokens(maximum=1):
+    # waits for one token and takes the free tokens up to maximum, gives the number of the taken tokens
+    tokens = [takeJobToken(True)]
+    while len(tokens) < maximum:
+        token = takeJobToken(False)
+        if token is None:
+            break
+        tokens.append(token)
+
+    try:
+        yield len(tokens)
+    finally:
+        os.write(getJobserver()["write"], b"".join(tokens))
+
+def getJobserverFds(env):
+    # the descriptors of the jobserver pipe are passed only to the commands that use it
+    if env and "MAKEFLAGS" in env and jobserverPool is not None:
+        return jobserverPool["fds"]
+    return ()
+
+def getJobserverEnv(env=None):
+    return {**(env or {}), "MAKEFLAGS": f"-j{getCpusCount()} --jobserver-auth={getJobserver()["auth"]}"}
+
+# only the last LOG_CAPTURE_LINES lines of the output are returned, the whole output only with captureOutput (for the commands whose output is parsed)
+# with jobserver, the command takes a token of the CPU budget and can use the jobserver through MAKEFLAGS (make, gcc -flto=auto)
+def buildExecute(cmd, checkValid=True, input_data=None, cwd=None, env=None, captureOutput=False, jobserver=False):
+    if jobserver:
+        with jobTokens():
+            return buildExecute(cmd, checkValid, input_data, cwd, getJobserverEnv(env), captureOutput)
+
     if cwd != None:
         buildLog(f"Execute command from directory ({cwd}): {cmd}")
     else:
         buildLog(f"Execute command: {cmd}")
     
+    startTime = time.monotonic()
     process = subprocess.Popen(
         cmd,
         stdin=subprocess.PIPE,
@@ -286,7 +819,9 @@ def buildExecute(cmd, checkValid=True, input_data=None, cwd=None):
         encoding="utf-8",
         errors="replace",
         bufsize=1,
-        cwd=cwd
+        cwd=cwd,
+        env={**os.environ, **env} if env else None,
+        pass_fds=getJobserverFds(env)
     )
 
     if process.stdin:
@@ -295,13 +830,14 @@ def buildExecute(cmd, checkValid=True, input_data=None, cwd=None):
             process.stdin.write(input_data)
         process.stdin.close()
 
-    output_lines = []
+    output_lines = [] if captureOutput else collections.deque(maxlen=LOG_CAPTURE_LINES)
     for line in process.stdout:
         buildLog(line.rstrip(), True)
         output_lines.append(line)
 
     process.stdout.close()
     returncode = process.wait()
+    recordCommandDuration(cmd, time.monotonic() - startTime)
 
     if returncode != 0 and checkValid:
         buildLog("ERROR: failed to build")
@@ -309,12 +845,17 @@ def buildExecute(cmd, checkValid=True, input_data=None, cwd=None):
 
     return "\n".join(output_lines)
 
-def buildRawExecute(cmd, checkValid=True, cwd=None):
+def buildRawExecute(cmd, checkValid=True, cwd=None, captureOutput=False, env=None, jobserver=False):
+    if jobserver:
+        with jobTokens():
+            return buildRawExecute(cmd, checkValid, cwd, captureOutput, getJobserverEnv(env))
+
     if cwd != None:
         buildLog(f"Execute raw command from directory ({cwd}): {cmd}")
     else:
         buildLog(f"Execute raw command: {cmd}")
     
+    startTime = time.monotonic()
     process = subprocess.Popen(
         cmd,
         shell=True,             
@@ -324,16 +865,19 @@ def buildRawExecute(cmd, checkValid=True, cwd=None):
         encoding="utf-8",
         errors="replace",
         bufsize=1,
-        cwd=cwd
+        cwd=cwd,
+        env={**os.environ, **env} if env else None,
+        pass_fds=getJobserverFds(env)
     )
 
-    output_lines = []
+    output_lines = [] if captureOutput else collections.deque(maxlen=LOG_CAPTURE_LINES)
     for line in process.stdout:
         buildLog(line.rstrip(), True)
         output_lines.append(line)
     
     process.stdout.close()
     returncode = process.wait()
+    recordCommandDuration(cmd, time.monotonic() - startTime)
 
     if returncode != 0 and checkValid:
         buildLog("ERROR: failed to build")
@@ -352,12 +896,7 @@ def buildItemLog(item, comment=None, comment2=None, hideExport=False):
 
 def makeChmod(path, chmodList):
     for chmodAction in chmodList:
-        cmd = ["chmod"]
-        if chmodAction[2]:
-            cmd.append("-R")
-        cmd.append(chmodAction[1])
-        cmd.append(pathConcat(path, chmodAction[0]))
-        buildExecute(cmd)
+        applyRights(pathConcat(path, chmodAction[0]), -1, -1, chmodAction[1], chmodAction[2])
 
 def chownStr(uid, gid):
     chownString = ""
@@ -372,12 +911,7 @@ def chownStr(uid, gid):
 
 def makeChown(path, chownList):
     for chownAction in chownList:
-        cmd = ["chown"]
-        if chownAction[3]:
-            cmd.append("-R")
-        cmd.append(chownStr(chownAction[1], chownAction[2]))
-        cmd.append(pathConcat(path, chownAction[0]))
-        buildExecute(cmd)
+        applyRights(pathConcat(path, chownAction[0]), chownAction[1], chownAction[2], None, chownAction[3])
 
 def emptyFile(path):
     with open(path, "w") as f:
@@ -418,15 +952,86 @@ minDebianPackages = [
     "dpkg"
 ]
 
-def buildDebian(item):
-    includeList = item.get("include", [])
+def getDebianIncludeList(item):
+    includeList = list(item.get("include", []))
     if "kernel" in item:
         includeList.append(getDebianKernelName(item["kernel"]))
-    
+    if item["variant"] == "_min":
+        includeList += minDebianPackages
+    return includeList
+
+# the bootstrapped debian systems are saved as compressed tarballs and restored instead of running mmdebstrap again
+# the key contains only what mmdebstrap depends on, so the same system from another project or builditem is also restored
+# increase the version if the bootstrap process changes
+DEBIAN_SNAPSHOT_VERSION = 1
+
+def getDebianSnapshotKey(item):
+    return dictChecksum({
+        "version": DEBIAN_SNAPSHOT_VERSION,
+        "architecture": architecture,
+        "variant": item["variant"],
+        "suite": item["suite"],
+        "url": item["url"],
+        "components": item.get("components"),
+        "include": sorted(set(getDebianIncludeList(item))),
+        "hook-directory": get_dir_checksum(item["hook-directory"]) if "hook-directory" in item else None
+    })
+
+def getDebianSnapshotsPath():
+    return args.debian_snapshots or path_temp_debian_snapshots
+
+def getDebianSnapshotCompressor(threads=1):
+    # tar adds -d itself when extracting
+    if shutil.which("zstd"):
+        return "zst", f"zstd -T{threads}"
+    elif shutil.which("pigz"):
+        return "gz", f"pigz -p {threads}"
+    return "gz", "gzip"
+
+def findDebianSnapshot(key):
+    for extension, compressor in [("zst", "zstd"), ("gz", "pigz" if shutil.which("pigz") else "gzip")]:
+        snapshotPath = pathConcat(getDebianSnapshotsPath(), f"{key}.tar.{extension}")
+        if os.path.isfile(snapshotPath) and shutil.which(compressor.split()[0]):
+            return snapshotPath, compressor
+    return None, None
+
+def publishDebianSnapshot(key, itemFolder):
+    with jobTokens(getCpusCount()) as threads:
+        extension, compressor = getDebianSnapshotCompressor(threads)
+        snapshotPath = pathConcat(getDebianSnapshotsPath(), f"{key}.tar.{extension}")
+        tempPath = f"{snapshotPath}.tmp-{os.getpid()}-{threading.get_ident()}"
+        os.makedirs(getDebianSnapshotsPath(), exist_ok=True)
+
+        buildExecute(["tar", "-I", compressor, "--numeric-owner", "--xattrs", "--xattrs-include=*", "-cpf", tempPath, "-C", itemFolder, "."])
+    os.replace(tempPath, snapshotPath)
+    buildLog(f"Debian snapshot saved: {snapshotPath} ({formatBytes(os.path.getsize(snapshotPath))})")
+
+def buildDebian(item):
+    if not item.get("debian-snapshot", True):
+        bootstrapDebian(item)
+        return
+
+    key = getDebianSnapshotKey(item)
+
+    # while one builditem bootstraps the system, the others with the same key wait for it
+    with fileLock(pathConcat(getDebianSnapshotsPath(), ".locks", key + ".lock")):
+        snapshotPath, compressor = findDebianSnapshot(key)
+        if snapshotPath and not args.n:
+            buildLog(f"Debian snapshot restored: {snapshotPath}")
+            itemFolder = getItemFolder(item)
+            buildExecute(["tar", "-I", compressor, "--numeric-owner", "--xattrs", "--xattrs-include=*", "-xpf", snapshotPath, "-C", itemFolder], jobserver=True)
+            os.utime(snapshotPath)
+            return
+
+        bootstrapDebian(item)
+        publishDebianSnapshot(key, getItemPath(item))
+
+def bootstrapDebian(item):
+    includeList = getDebianIncludeList(item)
+
     variant = item["variant"]
     if variant == "_min":
         variant = "custom"
-        includeList += minDebianPackages
 
     include_arg = "--include=" + ",".join(includeList) if includeList else None
     # exclude_arg = "--exclude=" + ",".join(item["exclude"]) if item.get("exclude") else None
@@ -451,8 +1056,17 @@ def buildDebian(item):
     if "hook-directory" in item:
         makeAllFilesExecutable(item["hook-directory"])
         cmd.append(f"--hook-directory={item["hook-directory"]}")
+
+    aptArchive = None
+    if item.get("apt-archive", True):
+        aptArchive = getAptArchivePath(item["url"])
+        aptStaging = getTempFolder("apt_archive_staging")
+        cmd += getAptArchiveHooks(aptArchive, aptStaging)
     buildExecute(cmd)
 
+    if aptArchive:
+        publishAptArchive(aptArchive, aptStaging)
+
     hostsFile = """127.0.0.1 localhost
     127.0.1.1 hostname"""
 
@@ -485,6 +1099,142 @@ def buildDebian(item):
         
         changeAccessRights(path_resolv_conf, [0, 0, "0644"])
 
+# the .deb files and Packages indices downloaded by mmdebstrap are kept in a shared archive and given to the next builds
+# the archive is separate for each repository url (for snapshot.debian.org urls this is a fixed snapshot)
+# inside it, the .deb files are named PACKAGE_VERSION_ARCH.deb, so "Architecture: all" packages are shared by all architectures
+# apt checks the checksums of the .deb files from the archive against the Packages index and downloads the missing ones
+def getAptArchivePath(url):
+    basePath = args.apt_archive or path_temp_apt_archives
+    return pathConcat(basePath, hashlib.sha256(url.strip().encode()).hexdigest()[:32])
+
+# the files are hardlinked if the archive and the system are on the same filesystem (apt and dpkg only replace and delete them), otherwise copied
+APT_ARCHIVE_LINK_COMMAND = "cp -l -f -t \"$0\" \"$@\" 2>/dev/null || cp -n -p --reflink=auto -t \"$0\" \"$@\""
+
+def getAptArchiveSeedCommands(aptArchive):
+    # shell commands that give the packages and indices of the architecture from the archive to the system "$1"
+    aptArchive = os.path.abspath(aptArchive)
+    listsArchive = pathConcat(aptArchive, "lists", architecture)
+    return [
+        "mkdir -p \"$1/var/cache/apt/archives\" \"$1/var/lib/apt/lists\"",
+        f"find \"{aptArchive}\" -maxdepth 1 -type f \\( -name \"*_{architecture}.deb\" -o -name \"*_all.deb\" \\) -exec sh -c '{APT_ARCHIVE_LINK_COMMAND}' \"$1/var/cache/apt/archives\" {{}} + 2>/dev/null || true",
+        f"find \"{listsArchive}\" -maxdepth 1 -type f -exec sh -c '{APT_ARCHIVE_LINK_COMMAND}' \"$1/var/lib/apt/lists\" {{}} + 2>/dev/null || true"
+    ]
+
+def getAptArchiveStageCommands(aptArchive, aptStaging):
+    # shell commands that give the new packages and the indices of the system "$1" to the staging directory
+    # the packages that are already in the archive (the seeded ones) are not staged
+    aptArchive = os.path.abspath(aptArchive)
+    aptStaging = os.path.abspath(aptStaging)
+    return [
+        f"find \"$1/var/cache/apt/archives\" -maxdepth 1 -type f -name \"*.deb\" -exec sh -c 'for f; do [ -e \"{aptArchive}/${{f##*/}}\" ] || ln -f \"$f\" \"{aptStaging}/archives/\" 2>/dev/null || cp -p \"$f\" \"{aptStaging}/archives/\"; done' sh {{}} + 2>/dev/null || true",
+        f"find \"$1/var/lib/apt/lists\" -maxdepth 1 -type f ! -name lock -exec sh -c '{APT_ARCHIVE_LINK_COMMAND}' \"{aptStaging}/lists\" {{}} + 2>/dev/null || true"
+    ]
+
+def getAptArchiveHooks(aptArchive, aptStaging):
+    aptArchive = os.path.abspath(aptArchive)
+    aptStaging = os.path.abspath(aptStaging)
+    os.makedirs(pathConcat(aptStaging, "archives"), exist_ok=True)
+    os.makedirs(pathConcat(aptStaging, "lists"), exist_ok=True)
+
+    hooks = ["--skip=essential/unlink"]
+    if not args.d:
+        for command in getAptArchiveSeedCommands(aptArchive):
+            hooks.append(f"--setup-hook={command}")
+
+    # the last customize hook: the packages installed by the hooks from "hook-directory" also get into the archive
+    for command in getAptArchiveStageCommands(aptArchive, aptStaging):
+        hooks.append(f"--customize-hook={command}")
+    return hooks
+
+def publishAptArchive(aptArchive, aptStaging):
+    listsArchive = pathConcat(aptArchive, "lists", architecture)
+    os.makedirs(listsArchive, exist_ok=True)
+
+    # the files are published atomically, other builds can read the archive at the same time
+    published = 0
+    with fileLock(aptArchive + ".lock"):
+        for stagingDirectory, targetDirectory, suffix in [(pathConcat(aptStaging, "archives"), aptArchive, ".deb"), (pathConcat(aptStaging, "lists"), listsArchive, "")]:
+            if not os.path.isdir(stagingDirectory):
+                continue
+
+            for name in os.listdir(stagingDirectory):
+                stagingPath = pathConcat(stagingDirectory, name)
+                targetPath = pathConcat(targetDirectory, name)
+                if not name.endswith(suffix) or name == "lock" or not os.path.isfile(stagingPath) or os.path.islink(stagingPath):
+                    continue
+                if suffix == ".deb" and os.path.exists(targetPath):
+                    continue
+
+                shutil.move(stagingPath, targetPath + ".tmp")
+                os.replace(targetPath + ".tmp", targetPath)
+                if suffix == ".deb":
+                    published += 1
+
+    deleteDirectory(aptStaging)
+    buildLog(f"Apt archive: {published} new packages in {aptArchive}")
+
+def getDebianRootfsUrl(rootfs):
+    # the url of the repository from which the system was bootstrapped (mmdebstrap writes it to sources.list)
+    sourcesListPath = pathConcat(rootfs, "etc/apt/sources.list")
+    if os.path.isfile(sourcesListPath):
+        with open(sourcesListPath, "r") as f:
+            for line in f:
+                parts = re.sub(r"\[[^\]]*\]", "", line).split()
+                if len(parts) >= 2 and parts[0] == "deb":
+                    return parts[1]
+    return None
+
+def runHookDirectory(hookDirectory, prefix, rootfs):
+    # mmdebstrap rules: the executable files whose names begin with the phase name, in alphabetical order, "$1" is the path to the system
+    makeAllFilesExecutable(hookDirectory)
+    for name in sorted(os.listdir(hookDirectory)):
+        hookPath = pathConcat(hookDirectory, name)
+        if name.startswith(prefix) and os.path.isfile(hookPath):
+            buildExecute([os.path.abspath(hookPath), os.path.abspath(rootfs)])
+
+def debianDerive(item):
+    itemPath = getDerivedItemFolder(item, findItem(item["source"]))
+
+    includeList = list(item.get("include", []))
+    if "kernel" in item:
+        includeList.append(getDebianKernelName(item["kernel"]))
+
+    aptArchive = None
+    url = getDebianRootfsUrl(itemPath)
+    if url and item.get("apt-archive", True):
+        aptArchive = getAptArchivePath(url)
+        if not args.d:
+            for command in getAptArchiveSeedCommands(aptArchive):
+                buildExecute(["sh", "-c", command, "sh", itemPath])
+
+    if includeList:
+        aptOptions = "-o Acquire::Check-Valid-Until=false -o Acquire::AllowInsecureRepositories=true -o APT::Get::AllowUnauthenticated=true"
+        aptScript = f"""set -e
+export DEBIAN_FRONTEND=noninteractive
+apt-get {aptOptions} update
+apt-get {aptOptions} install -y --no-install-recommends {" ".join(shlex.quote(package) for package in includeList)}
+"""
+        scriptPath = pathConcat(itemPath, ".syslbuild-debian-derive.sh")
+        with open(scriptPath, "w") as f:
+            f.write(aptScript)
+        changeAccessRights(scriptPath, DEFAULT_RIGHTS_0755)
+        rawCrossChroot(itemPath, ["/.syslbuild-debian-derive.sh"])
+        os.remove(scriptPath)
+
+    if "hook-directory" in item:
+        runHookDirectory(item["hook-directory"], "customize", itemPath)
+
+    if aptArchive:
+        aptStaging = getTempFolder("apt_archive_staging")
+        for name in ["archives", "lists"]:
+            os.makedirs(pathConcat(aptStaging, name))
+        for command in getAptArchiveStageCommands(aptArchive, aptStaging):
+            buildExecute(["sh", "-c", command, "sh", itemPath])
+        publishAptArchive(aptArchive, aptStaging)
+
+    # the same cleanup as mmdebstrap does at the end
+    buildRawExecute(f"find \"{pathConcat(itemPath, "var/cache/apt/archives")}\" \"{pathConcat(itemPath, "var/lib/apt/lists")}\" -maxdepth 1 -type f ! -name lock -delete 2>/dev/null || true")
+
 def makePacmanConfig(pacman_conf):
     lines = []
 
@@ -600,29 +1350,354 @@ def downloadFile(url, path):
 def buildDownload(item):
     downloadFile(item["url"], getItemPath(item))
 
+# chmod modes are applied without spawning chmod, the same way as GNU chmod does it (octal and symbolic modes)
+# the modes that cannot be parsed are passed to chmod itself
+CHMOD_WHO_BITS = {
+    "u": stat.S_ISUID | stat.S_IRWXU,
+    "g": stat.S_ISGID | stat.S_IRWXG,
+    "o": stat.S_ISVTX | stat.S_IRWXO,
+    "a": 0o7777
+}
+
+CHMOD_PERM_BITS = {
+    "r": stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH,
+    "w": stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH,
+    "x": stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH,
+    "s": stat.S_ISUID | stat.S_ISGID,
+    "t": stat.S_ISVTX
+}
+
+CHMOD_EXECUTE_BITS = stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH
+
+processUmask = None
+
+def getProcessUmask():
+    global processUmask
+    if processUmask is None:
+        processUmask = 0o022
+        try:
+            with open("/proc/self/status") as f:
+                for line in f:
+                    if line.startswith("Umask:"):
+                        processUmask = int(line.split()[1], 8)
+                        break
+        except (OSError, ValueError, IndexError):
+            pass
+    return processUmask
+
+def compileChmodMode(modeString):
+    if re.fullmatch(r"[0-7]+", modeString):
+        value = int(modeString, 8)
+        if value > 0o7777:
+            return None
+        return ("octal", value, len(modeString) >= 5)
+
+    clauses = []
+    for clause in modeString.split(","):
+        match = re.fullmatch(r"([ugoa]*)((?:[-+=](?:[ugo]|[rwxXst]*))+)", clause)
+        if not match:
+            return None
+
+        who = 0
+        for char in match.group(1):
+            who |= CHMOD_WHO_BITS[char]
+
+        actions = []
+        for operator, perms in re.findall(r"([-+=])([ugo]|[rwxXst]*)", match.group(2)):
+            value = 0
+            if perms not in ("u", "g", "o"):
+                for char in perms.replace("X", ""):
+                    value |= CHMOD_PERM_BITS[char]
+            actions.append((operator, perms, value))
+        clauses.append((who, actions))
+
+    return ("symbolic", clauses)
+
+def applyChmodMode(compiledMode, oldMode, isDir):
+    oldMode = stat.S_IMODE(oldMode)
+
+    if compiledMode[0] == "octal":
+        newMode = compiledMode[1]
+        if isDir and not compiledMode[2]:
+            # like GNU chmod, the set-user-ID and set-group-ID bits of the directories are kept until they are set or cleared explicitly
+            newMode |= oldMode & (stat.S_ISUID | stat.S_ISGID)
+        return newMode
+
+    newMode = oldMode
+    for who, actions in compiledMode[1]:
+        for operator, perms, value in actions:
+            mentioned = (who & value) if who else value
+            omitted = ((stat.S_ISUID | stat.S_ISGID) & ~mentioned) if isDir else 0
+
+            if perms in ("u", "g", "o"):
+                shift = {"u": 6, "g": 3, "o": 0}[perms]
+                value = (newMode >> shift) & 0o7
+                value = value << 6 | value << 3 | value
+            elif "X" in perms and (isDir or (newMode & CHMOD_EXECUTE_BITS)):
+                value |= CHMOD_EXECUTE_BITS
+
+            # without the "who" part, the bits of the umask are not affected
+            value &= (who or (0o7777 & ~getProcessUmask())) & ~omitted
+            if operator == "+":
+                newMode |= value
+            elif operator == "-":
+                newMode &= ~value
+            else:
+                preserved = ((0o7777 & ~who) if who else 0) | omitted
+                newMode = (newMode & preserved) | value
+
+    return newMode
+
+def changeEntryRights(path, entryStat, uid, gid, compiledMode):
+    # the same order as chmod -R followed by chown -R, so the kernel clears the set-user-ID bits and the file capabilities the same way
+    if compiledMode and not stat.S_ISLNK(entryStat.st_mode):
+        newMode = applyChmodMode(compiledMode, entryStat.st_mode, stat.S_ISDIR(entryStat.st_mode))
+        if newMode != stat.S_IMODE(entryStat.st_mode):
+            os.chmod(path, newMode)
+
+    if uid >= 0 or gid >= 0:
+        os.lchown(path, uid, gid)
+
+def applyRights(path, uid, gid, modeString, recursive):
+    compiledMode = compileChmodMode(modeString) if modeString else None
+
+    if (modeString and not compiledMode) or os.path.islink(path):
+        # the symlinks in the arguments are resolved differently by chmod and chown, so they stay with the utilities
+        if modeString:
+            buildExecute(["chmod"] + (["-R"] if recursive else []) + [modeString, path])
+        chownString = chownStr(uid, gid)
+        if chownString:
+            buildExecute(["chown"] + (["-R"] if recursive else []) + [chownString, path])
+        return
+
+    try:
+        entryStat = os.lstat(path)
+        changeEntryRights(path, entryStat, uid, gid, compiledMode)
+
+        if recursive and stat.S_ISDIR(entryStat.st_mode):
+            for root, dirs, files in os.walk(path):
+                for name in dirs + files:
+                    entryPath = os.path.join(root, name)
+                    changeEntryRights(entryPath, os.lstat(entryPath), uid, gid, compiledMode)
+    except OSError as e:
+        buildLog(f"ERROR: failed to change the access rights of {path}: {e}")
+        sys.exit(1)
+
 def changeAccessRights(path, changeRights):
-    if len(changeRights) >= 3 and changeRights[2]:
-        buildExecute(["chmod", "-R", changeRights[2], path])
-    
-    chownString = chownStr(changeRights[0], changeRights[1])
-    if chownString:
-        buildExecute(["chown", "-R", chownString, path])
+    modeString = changeRights[2] if len(changeRights) >= 3 and changeRights[2] else None
+    applyRights(path, changeRights[0], changeRights[1], modeString, True)
 
 def recursionDeleleSymlinks(directoryPath):
     buildRawExecute("find . -type l -exec rm -f {} +", True, directoryPath)
 
-def copyItemFiles(fromPath, toPath, changeRights=None):
+def isRightsApplied(path, changeRights):
+    # according to the manifest, the tree already has the required owner and mode, so chmod -R and chown -R will not change anything
+    manifest, relpath = findPathManifest(path)
+    if not manifest:
+        return False
+
+    mode = None
+    if len(changeRights) >= 3 and changeRights[2]:
+        if not re.fullmatch(r"[0-7]{1,4}", changeRights[2]):
+            return False
+        mode = int(changeRights[2], 8)
+
+    for entry in getManifestEntries(manifest, relpath):
+        if entry[1] == "l":
+            continue
+        if mode is not None and entry[2] != mode:
+            return False
+        if changeRights[0] >= 0 and entry[3] != changeRights[0]:
+            return False
+        if changeRights[1] >= 0 and entry[4] != changeRights[1]:
+            return False
+    return True
+
+# the copies are made with reflinks (FICLONE) on btrfs/XFS, otherwise cp uses copy_file_range, so the data is not copied through the userspace
+# hardlinks are only used for the builditems that do not change the copied files (the "hardlinks" key of the "directory" builditem)
+FICLONE = 0x40049409
+
+def isSameDevice(fromPath, toPath):
+    try:
+        return os.stat(fromPath).st_dev == os.stat(toPath if os.path.exists(toPath) else os.path.dirname(toPath) or ".").st_dev
+    except OSError:
+        return False
+
+def getCopyArgs(hardlinks, fromPath=None, toPath=None):
+    if hardlinks:
+        # the existing files are deleted before copying, so as not to write to the file that is hardlinked to another builditem
+        if fromPath and toPath and isSameDevice(fromPath, toPath):
+            return ["-l", "--remove-destination"]
+        return ["--reflink=auto", "--remove-destination"]
+    return ["--reflink=auto"]
+
+def getFileDataRanges(fd, size):
+    # the data ranges of a sparse file, the holes between them are not read and not written
+    ranges = []
+    offset = 0
+    try:
+        while offset < size:
+            try:
+                dataOffset = os.lseek(fd, offset, os.SEEK_DATA)
+            except OSError as e:
+                if e.errno == errno.ENXIO:
+                    break
+                raise
+            holeOffset = min(os.lseek(fd, dataOffset, os.SEEK_HOLE), size)
+            ranges.append((dataOffset, holeOffset - dataOffset))
+            offset = holeOffset
+    except OSError:
+        # the filesystem does not support SEEK_DATA / SEEK_HOLE
+        return [(0, size)] if size else []
+    return ranges
+
+def copyFileRange(fromFd, toFd, offset, length, toOffset=None):
+    if toOffset is None:
+        toOffset = offset
+    while length > 0:
+        copied = os.copy_file_range(fromFd, toFd, min(length, 1024 * 1024 * 1024), offset, toOffset)
+        if not copied:
+            break
+        offset += copied
+        toOffset += copied
+        length -= copied
+
+def writeSparse(fromFile, toFile, offset, length, toOffset=None):
+    # the zero blocks are skipped, the target region must already be a hole
+    fromFile.seek(offset)
+    toFile.seek(offset if toOffset is None else toOffset)
+    while length > 0:
+        block = fromFile.read(min(length, 1024 * 1024))
+        if not block:
+            break
+        if block.count(0) == len(block):
+            toFile.seek(len(block), os.SEEK_CUR)
+        else:
+            toFile.write(block)
+        length -= len(block)
+
+def copyFileData(fromPath, toPath):
+    with open(fromPath, "rb") as fromFile, open(toPath, "wb") as toFile:
+        try:
+            fcntl.ioctl(toFile.fileno(), FICLONE, fromFile.fileno())
+            return
+        except OSError:
+            pass
+
+        # the holes of the source file stay holes, so the images are not inflated by copying
+        size = os.fstat(fromFile.fileno()).st_size
+        ranges = getFileDataRanges(fromFile.fileno(), size)
+        try:
+            for offset, length in ranges:
+                copyFileRange(fromFile.fileno(), toFile.fileno(), offset, length)
+        except OSError:
+            toFile.truncate(0)
+            for offset, length in ranges:
+                writeSparse(fromFile, toFile, offset, length)
+        toFile.truncate(size)
+
+def copyFile(fromPath, toPath, hardlinks=False):
+    if hardlinks and os.path.isfile(fromPath) and not os.path.islink(fromPath) and isSameDevice(fromPath, toPath):
+        os.link(fromPath, toPath)
+        return
+
+    # the same as shutil.copy2, but with reflinks / copy_file_range
+    copyFileData(fromPath, toPath)
+    shutil.copystat(fromPath, toPath)
+
+def copyXattrs(fromPath, toPath):
+    try:
+        names = os.listxattr(fromPath, follow_symlinks=False)
+    except OSError:
+        return
+
+    for name in names:
+        try:
+            os.setxattr(toPath, name, os.getxattr(fromPath, name, follow_symlinks=False), follow_symlinks=False)
+        except OSError:
+            # like cp -a, the attributes that are not supported by the target filesystem are skipped
+            pass
+
+def copyEntryWithRights(fromPath, toPath, entryStat, uid, gid, compiledMode, linkedInodes):
+    # the entry is written once and immediately gets the same attributes that cp -a, chmod -R and chown -R would give it
+    if os.path.lexists(toPath) and not (stat.S_ISDIR(entryStat.st_mode) and os.path.isdir(toPath) and not os.path.islink(toPath)):
+        if os.path.isdir(toPath) and not os.path.islink(toPath):
+            shutil.rmtree(toPath)
+        else:
+            os.remove(toPath)
+
+    if not stat.S_ISDIR(entryStat.st_mode) and entryStat.st_nlink > 1:
+        inode = (entryStat.st_dev, entryStat.st_ino)
+        if inode in linkedInodes:
+            os.link(linkedInodes[inode], toPath)
+            return
+        linkedInodes[inode] = toPath
+
+    if stat.S_ISREG(entryStat.st_mode):
+        copyFileData(fromPath, toPath)
+    elif stat.S_ISDIR(entryStat.st_mode):
+        if not os.path.isdir(toPath):
+            os.mkdir(toPath)
+    elif stat.S_ISLNK(entryStat.st_mode):
+        os.symlink(os.readlink(fromPath), toPath)
+    else:
+        os.mknod(toPath, entryStat.st_mode, entryStat.st_rdev)
+
+    os.lchown(toPath, entryStat.st_uid, entryStat.st_gid)
+    if not stat.S_ISLNK(entryStat.st_mode):
+        os.chmod(toPath, stat.S_IMODE(entryStat.st_mode))
+    copyXattrs(fromPath, toPath)
+    changeEntryRights(toPath, entryStat, uid, gid, compiledMode)
+
+    if stat.S_ISDIR(entryStat.st_mode):
+        copyTreeEntriesWithRights(fromPath, toPath, uid, gid, compiledMode, linkedInodes)
+
+    # the timestamps of the directories are set after their content is written
+    os.utime(toPath, ns=(entryStat.st_atime_ns, entryStat.st_mtime_ns), follow_symlinks=False)
+
+def copyTreeEntriesWithRights(fromPath, toPath, uid, gid, compiledMode, linkedInodes):
+    with os.scandir(fromPath) as entries:
+        for entry in entries:
+            copyEntryWithRights(entry.path, os.path.join(toPath, entry.name), entry.stat(follow_symlinks=False), uid, gid, compiledMode, linkedInodes)
+
+def copyTreeWithRights(fromPath, toPath, changeRights):
+    modeString = changeRights[2] if len(changeRights) >= 3 and changeRights[2] else None
+    compiledMode = compileChmodMode(modeString) if modeString else None
+    if modeString and not compiledMode:
+        return False
+
+    # the rights of the target directory itself do not change, its timestamps and attributes are taken from the source directory
+    try:
+        copyTreeEntriesWithRights(fromPath, toPath, changeRights[0], changeRights[1], compiledMode, {})
+        copyXattrs(fromPath, toPath)
+        rootStat = os.stat(fromPath)
+        os.utime(toPath, ns=(rootStat.st_atime_ns, rootStat.st_mtime_ns))
+    except OSError as e:
+        buildLog(f"ERROR: failed to copy {fromPath} to {toPath}: {e}")
+        sys.exit(1)
+
+    return True
+
+def copyItemFiles(fromPath, toPath, changeRights=None, hardlinks=False):
     if os.path.isdir(fromPath):
         makedirsChangeRights(toPath)
-        if changeRights:
-            tempFolder = getTempFolder("changeRights")
-            buildExecute(["cp", "-a", fromPath + "/.", tempFolder])
-            changeAccessRights(tempFolder, changeRights)
-            buildExecute(["chmod", "--reference=" + toPath, tempFolder])
-            buildExecute(["chown", "--reference=" + toPath, tempFolder])
-            buildExecute(["cp", "-a", tempFolder + "/.", toPath])
+        if changeRights and isRightsApplied(fromPath, changeRights):
+            # the rights of the target directory itself do not change, as with the copy through the temporary folder
+            target_stat = os.stat(toPath)
+            buildExecute(["cp", "-a"] + getCopyArgs(hardlinks, fromPath, toPath) + [fromPath + "/.", toPath])
+            os.chown(toPath, target_stat.st_uid, target_stat.st_gid)
+            os.chmod(toPath, stat.S_IMODE(target_stat.st_mode))
+        elif changeRights:
+            if not copyTreeWithRights(fromPath, toPath, changeRights):
+                # the mode that is understood only by chmod itself
+                tempFolder = getTempFolder("changeRights")
+                buildExecute(["cp", "-a", "--reflink=auto", fromPath + "/.", tempFolder])
+                changeAccessRights(tempFolder, changeRights)
+                buildExecute(["chmod", "--reference=" + toPath, tempFolder])
+                buildExecute(["chown", "--reference=" + toPath, tempFolder])
+                buildExecute(["cp", "-a"] + getCopyArgs(hardlinks, tempFolder, toPath) + [tempFolder + "/.", toPath])
         else:
-            buildExecute(["cp", "-a", fromPath + "/.", toPath])
+            buildExecute(["cp", "-a"] + getCopyArgs(hardlinks, fromPath, toPath) + [fromPath + "/.", toPath])
     else:
         # this is necessary to correctly overwrite the symlink that links to a working file in the host system.
         deleteAny(toPath)
@@ -631,26 +1706,45 @@ def copyItemFiles(fromPath, toPath, changeRights=None):
         if not os.path.isdir(file_dir):
             makedirsChangeRights(file_dir)
 
-        shutil.copy2(fromPath, toPath)
+        copyFile(fromPath, toPath, hardlinks and not changeRights)
         if changeRights:
             changeAccessRights(toPath, changeRights)
 
 def allocateFile(path, size):
     buildLog(f"Allocation file with size {size}: {path}")
 
+    # the file is sparse, the blocks are allocated only when something is written to them
     bs = 1024 * 1024
     count = math.ceil(size / bs)
 
-    buildExecute([
-        "dd",
-        "if=/dev/zero",
-        f"of={path}",
-        "bs=" + str(bs),
-        "count=" + str(count)
-    ])
-    # buildExecute(["truncate", "-s", str(size), path])
+    with open(path, "wb") as f:
+        f.truncate(bs * count)
+
+def getFilesystemPopulateMethod(item):
+    # the filesystem is created directly from the source directory, without a loop device and mounting
+    # the owners and access rights are taken from the source directory as they are
+    if not item.get("populate", True) or not "fs_type" in item:
+        return None
+
+    fs_type = item["fs_type"]
+    if fs_type in ("ext2", "ext3", "ext4"):
+        return "mkfs"
+    elif fs_type == "btrfs" and shutil.which("mkfs.btrfs"):
+        return "mkfs"
+    elif "fat" in fs_type and shutil.which("mcopy"):
+        return "mtools"
+
+    return None
+
+def populateFatFilesystem(path, sourcePath):
+    entries = sorted(os.listdir(sourcePath))
+    if entries:
+        buildExecute(
+            ["mcopy", "-i", path, "-s", "-p", "-m", "-Q"] + [os.path.join(sourcePath, name) for name in entries] + ["::/"],
+            env={"MTOOLS_SKIP_CHECK": "1"}
+        )
 
-def formatFilesystem(path, item):
+def formatFilesystem(path, item, populatePath=None):
     fs_type = item["fs_type"]
     fs_subtype = None
     if fs_type == "fat12":
@@ -685,6 +1779,13 @@ def formatFilesystem(path, item):
     if fs_subtype is not None:
         cmd.append("-F")
         cmd.append(str(fs_subtype))
+
+    if populatePath:
+        if fs_type == "btrfs":
+            cmd.append("--rootdir")
+        else:
+            cmd.append("-d")
+        cmd.append(populatePath)
     
     cmd.append(path)
     buildExecute(cmd)
@@ -703,13 +1804,11 @@ def mountFilesystem(img_path, mount_path, offset=None):
     mount_path = os.path.normpath(mount_path)
     os.makedirs(mount_path, exist_ok=True)
 
-    result = subprocess.run(["losetup", "-f"], capture_output=True, text=True, check=True)
-    loop_device = result.stdout.strip()
-
-    losetup_cmd = ["losetup", loop_device, img_path]
+    # the free device is found and attached in one step, so builditems threads and --parallel-arch processes can not take the same device
+    losetup_cmd = ["losetup", "-f", "--show"]
     if offset:
-        losetup_cmd.insert(2, f"-o {offset}")
-    buildExecute(losetup_cmd)
+        losetup_cmd += ["-o", str(offset)]
+    loop_device = buildExecute(losetup_cmd + [img_path], captureOutput=True).strip().splitlines()[-1]
 
     buildExecute(["mount", loop_device, mount_path])    
     mountLoops[mount_path] = loop_device
@@ -722,11 +1821,13 @@ def umountFilesystem(mount_path):
 
     if os.path.exists(mount_path):
         buildExecute(["umount", mount_path], False)
-        if loop_device:
-            buildExecute(["losetup", "-d", loop_device])
+    if loop_device:
+        # after a lazy umount the device is detached when it is released
+        buildExecute(["losetup", "-d", loop_device], False)
+    if os.path.exists(mount_path):
         deleteDirectory(mount_path)
 
-def rawItemsProcess(items, itemsDirectory):
+def rawItemsProcess(items, itemsDirectory, hardlinks=False):
     for itemObj in items:
         itemPath = findItem(itemObj[0])
         outputPath = pathConcat(itemsDirectory, itemObj[1])
@@ -742,15 +1843,30 @@ def rawItemsProcess(items, itemsDirectory):
         if changeRights:
             buildLog(f"With custom rights: {changeRights}")
         
-        copyItemFiles(itemPath, outputPath, changeRights)
+        copyItemFiles(itemPath, outputPath, changeRights, hardlinks)
+
+def isLayerBaseItem(itemObj):
+    # ["builditem", "."] without custom rights can be used as the lower layer of the directory
+    return (len(itemObj) < 3 or not itemObj[2]) and os.path.normpath(itemObj[1].lstrip("/") or ".") == "." and not isUserItem(itemObj[0]) and os.path.isdir(findItem(itemObj[0]))
 
 def buildDirectory(item):
     buildDirectoryPath = getItemFolder(item)
 
+    hardlinks = readBool(item, "hardlinks")
+    if hardlinks and ("chmod" in item or "chown" in item):
+        buildLog("WARNING: \"hardlinks\" is ignored because the builditem changes the rights of the copied files (\"chmod\" / \"chown\")")
+        hardlinks = False
+
     if "deleteBeforeAdd" in item:
         for deletePath in item["deleteBeforeAdd"]:
             deleteAny(pathConcat(buildDirectoryPath, deletePath))
 
+    items = item.get("items", [])
+    if items and canUseLayer(item) and isLayerBaseItem(items[0]):
+        buildLog(f"Base layer: {findItem(items[0][0])}")
+        getDerivedItemFolder(item, findItem(items[0][0]))
+        items = items[1:]
+
     if "directories" in item:
         for directoryData in item["directories"]:
             directoryPath = pathConcat(buildDirectoryPath, directoryData[0])
@@ -759,8 +1875,8 @@ def buildDirectory(item):
             buildLog(f"Create empty directory: {directoryPath} {changeRights}")
             makedirsChangeRights(directoryPath, changeRights)
 
-    if "items" in item:
-        rawItemsProcess(item["items"], buildDirectoryPath)
+    if items:
+        rawItemsProcess(items, buildDirectoryPath, hardlinks)
 
     if "chmod" in item:
         makeChmod(buildDirectoryPath, item["chmod"])
@@ -802,13 +1918,20 @@ def buildFilesystem(item):
             fs_size = minsize
     allocateFile(fs_path, fs_size)
 
+    populateMethod = getFilesystemPopulateMethod(item) if fs_files else None
+    if populateMethod:
+        buildLog(f"Populating the filesystem from: {fs_files}")
+
     if "fs_type" in item:
-        formatFilesystem(fs_path, item)
+        formatFilesystem(fs_path, item, fs_files if populateMethod == "mkfs" else None)
 
-    if fs_files:
-        mountFilesystem(fs_path, path_mount)
-        copyItemFiles(fs_files, path_mount)
-        umountFilesystem(path_mount)
+    if populateMethod == "mtools":
+        populateFatFilesystem(fs_path, fs_files)
+    elif fs_files and not populateMethod:
+        mountPath = getWorkerPath(path_mount)
+        mountFilesystem(fs_path, mountPath)
+        copyItemFiles(fs_files, mountPath)
+        umountFilesystem(mountPath)
 
 parititionTypesList_gpt = {
     "linux": "0FC63DAF-8483-4772-8E79-3D69D8477DE4",
@@ -865,13 +1988,15 @@ def installBootloader(item, path, partitionsOffsets, sectorsize):
 
     if bootloaderType == "grub":
         efi = False
+        mountPath = getWorkerPath(path_mount)
+        mountPath2 = getWorkerPath(path_mount2)
 
-        mountFilesystem(path, path_mount, partitionsOffsets[bootloaderInfo["boot"]])
+        mountFilesystem(path, mountPath, partitionsOffsets[bootloaderInfo["boot"]])
         if "esp" in bootloaderInfo:
-            mountFilesystem(path, path_mount2, partitionsOffsets[bootloaderInfo["esp"]])
+            mountFilesystem(path, mountPath2, partitionsOffsets[bootloaderInfo["esp"]])
             efi = True
 
-        bootDirectory = pathConcat(path_mount, "boot")
+        bootDirectory = pathConcat(mountPath, "boot")
         makedirsChangeRights(bootDirectory)
 
         modulesString = ""
@@ -879,13 +2004,13 @@ def installBootloader(item, path, partitionsOffsets, sectorsize):
             modulesString = " ".join(bootloaderInfo["modules"])
 
         if efi:
-            buildExecute(["grub-install", f"--modules={modulesString}", f"--target={getGrubTarget(item, True)}", f"--boot-directory={bootDirectory}", path, f"--efi-directory={path_mount2}", "--removable"])
+            buildExecute(["grub-install", f"--modules={modulesString}", f"--target={getGrubTarget(item, True)}", f"--boot-directory={bootDirectory}", path, f"--efi-directory={mountPath2}", "--removable"])
 
             # in EFI mode, grub-install writes grub files to the /efi/boot directory, while grub itself searches for them simply by following the /boot/grub path
             # Thanks to the grub developers
-            grubdir = os.path.join(path_mount2, "boot", "grub")
+            grubdir = os.path.join(mountPath2, "boot", "grub")
             makedirsChangeRights(grubdir)
-            buildExecute(["cp", "-a", os.path.join(path_mount2, "efi", "boot") + "/.", grubdir])
+            buildExecute(["cp", "-a", os.path.join(mountPath2, "efi", "boot") + "/.", grubdir])
 
             if readBool(bootloaderInfo, "efiAndBios"):
                 buildExecute(["grub-install", f"--modules={modulesString}", f"--target={getGrubTarget(item, False)}", f"--boot-directory={bootDirectory}", path])
@@ -896,10 +2021,10 @@ def installBootloader(item, path, partitionsOffsets, sectorsize):
             makedirsChangeRights(pathConcat(bootDirectory, "grub"))
             copyItemFiles(findItem(bootloaderInfo["config"]), pathConcat(bootDirectory, "grub", "grub.cfg"), DEFAULT_RIGHTS)
 
-        umountFilesystem(path_mount)
+        umountFilesystem(mountPath)
 
         if efi:
-            umountFilesystem(path_mount2)
+            umountFilesystem(mountPath2)
     elif bootloaderType == "binary":
         firstPartitionOffset = min(partitionsOffsets)
 
@@ -923,6 +2048,43 @@ def installBootloader(item, path, partitionsOffsets, sectorsize):
         buildLog("ERROR: unknown bootloader type")
         sys.exit(1)
 
+def writePartition(partitionPath, diskPath, diskOffset, dropPageCache):
+    # only the data ranges of the partition image are copied, the disk image is sparse, so the holes are already zeros
+    with open(partitionPath, "rb") as partitionFile, open(diskPath, "r+b") as diskFile:
+        size = os.fstat(partitionFile.fileno()).st_size
+        ranges = getFileDataRanges(partitionFile.fileno(), size)
+        try:
+            for offset, length in ranges:
+                copyFileRange(partitionFile.fileno(), diskFile.fileno(), offset, length, diskOffset + offset)
+        except OSError:
+            for offset, length in ranges:
+                writeSparse(partitionFile, diskFile, offset, length, diskOffset + offset)
+            diskFile.flush()
+
+        if dropPageCache:
+            # the written image does not push the page cache of the other builditems out of memory
+            os.fdatasync(diskFile.fileno())
+            os.posix_fadvise(diskFile.fileno(), diskOffset, size, os.POSIX_FADV_DONTNEED)
+            os.posix_fadvise(partitionFile.fileno(), 0, size, os.POSIX_FADV_DONTNEED)
+
+def writePartitions(diskPath, partitionsPaths, partitionsOffsets, dropPageCache=False):
+    for i, partitionPath in enumerate(partitionsPaths):
+        buildLog(f"Write partition {i}: {partitionPath} > {diskPath} (offset {partitionsOffsets[i]})")
+
+    # the partitions do not overlap, so they are written concurrently
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, len(partitionsPaths))) as executor:
+        futures = [
+            executor.submit(writePartition, partitionPath, diskPath, partitionsOffsets[i], dropPageCache)
+            for i, partitionPath in enumerate(partitionsPaths)
+        ]
+
+        for i, future in enumerate(futures):
+            try:
+                future.result()
+            except OSError as e:
+                buildLog(f"ERROR: failed to write partition {i} ({partitionsPaths[i]}): {e}")
+                sys.exit(1)
+
 def buildFullDiskImage(item):
     # allocate file
     path = getItemPath(item)
@@ -946,7 +2108,7 @@ def buildFullDiskImage(item):
     buildExecute(["sfdisk", path], False, partitionTable)
 
     # apply partitions
-    resultPartitionTable = json5.loads(buildExecute(["sfdisk", "-J", path]))
+    resultPartitionTable = json5.loads(buildExecute(["sfdisk", "-J", path], captureOutput=True))
     resultPartitions = resultPartitionTable["partitiontable"]["partitions"]
     resultSectorsize = resultPartitionTable["partitiontable"]["sectorsize"]
 
@@ -954,14 +2116,7 @@ def buildFullDiskImage(item):
     for i, paritition in enumerate(resultPartitions):
         start_sector = paritition["start"]
         partitionsOffsets.append(start_sector * resultSectorsize)
-        buildExecute([
-            "dd",
-            f"if={partitionsPaths[i]}",
-            f"of={path}",
-            f"bs={resultSectorsize}",
-            "seek=" + str(start_sector),
-            "conv=notrunc"
-        ])
+    writePartitions(path, partitionsPaths, partitionsOffsets, readBool(item, "dropPageCache"))
 
     # install bootloader
     if "bootloader" in item:
@@ -1014,7 +2169,8 @@ def gccBuild(item):
         item.get("CFLAGS", []) +
         item.get("sources", collect_sources(item)) +
         item.get("LDFLAGS", []) +
-        ["-o", getItemPath(item)]
+        ["-o", getItemPath(item)],
+        jobserver=True
     )
 
 def buildInitramfs(item):
@@ -1029,7 +2185,9 @@ def buildInitramfs(item):
     buildRawExecute(f"find . -print0 | cpio --null -ov --format=newc > \"{outputPath}\"", True, source)
 
     if "compressor" in item:
-        buildRawExecute(f"{item["compressor"]} < \"{outputPath}\" > \"{realOutputPath}\"", True)
+        # xz and zstd take the number of threads from the environment, if it is not set in the compressor command
+        with jobTokens(getCpusCount()) as threads:
+            buildRawExecute(f"{item["compressor"]} < \"{outputPath}\" > \"{realOutputPath}\"", True, env={"XZ_DEFAULTS": f"-T{threads}", "ZSTD_NBTHREADS": str(threads)})
 
 def get_file_extension(url):
     path = urllib.parse.urlparse(url).path
@@ -1044,31 +2202,70 @@ def get_file_extension(url):
     _, ext = os.path.splitext(filename)
     return ext
 
+# every download of the kernel sources is a new directory HASH-TIME, HASH.current contains the name of the current one
+# the patched kernel trees are overlayfs mounts over the sources, so a download never deletes or unmounts the sources that the trees use
+# the previous downloads are deleted by evictKernelTrees when no kernel tree uses them
+runStartTime = None
+
+def getCurrentKernelSources(sources_hash):
+    current_path = pathConcat(path_temp_kernel_sources, sources_hash + ".current")
+    if os.path.isfile(current_path):
+        with open(current_path, "r") as f:
+            kernel_sources = pathConcat(path_temp_kernel_sources, f.read().strip())
+        if os.path.isdir(kernel_sources):
+            return kernel_sources, os.stat(current_path).st_mtime
+
+    # the sources downloaded by an older version of syslbuild
+    kernel_sources = pathConcat(path_temp_kernel_sources, sources_hash)
+    if os.path.isdir(kernel_sources) and os.path.isfile(kernel_sources + ".downloaded"):
+        return kernel_sources, os.stat(kernel_sources + ".downloaded").st_mtime
+    return None, None
+
+def isKernelSourcesDownloadNeeded(sources_hash):
+    kernel_sources, downloaded = getCurrentKernelSources(sources_hash)
+    if kernel_sources is None:
+        return True
+    # with -d, the sources are downloaded again once per build
+    return args.d and (runStartTime is None or downloaded < runStartTime)
+
+def newKernelSources(sources_hash):
+    kernel_sources = pathConcat(path_temp_kernel_sources, f"{sources_hash}-{time.time_ns()}")
+    os.makedirs(kernel_sources)
+    return kernel_sources
+
+def setCurrentKernelSources(sources_hash, kernel_sources):
+    current_path = pathConcat(path_temp_kernel_sources, sources_hash + ".current")
+    with open(current_path + ".tmp", "w") as f:
+        f.write(os.path.basename(kernel_sources))
+    os.replace(current_path + ".tmp", current_path)
+
+def getKernelSourcesHash(item):
+    if "kernel_source_url" in item:
+        return hashlib.md5(item["kernel_source_url"].encode('utf-8')).hexdigest()
+    url = item["kernel_source_git"]
+    return hashlib.md5(url.encode('utf-8') + item.get("kernel_source_git_branch", "").encode('utf-8') + item.get("kernel_source_git_checkout", "").encode('utf-8')).hexdigest()
+
+def getKernelSourcesLockPath(sources_hash):
+    return pathConcat(path_temp_kernel_sources, sources_hash + ".lock")
+
+# the download functions are called under the lock of the sources (getKernelSourcesLockPath)
 def downloadKernel(url, unpacker):
     url_hash = hashlib.md5(url.encode('utf-8')).hexdigest()
-    kernel_sources = pathConcat(path_temp_kernel_sources, url_hash)
-    kernel_sources_downloaded_flag = pathConcat(path_temp_kernel_sources, url_hash + ".downloaded")
     kernel_sources_archive = pathConcat(path_temp_kernel_sources, url_hash + get_file_extension(url))
 
-    if args.d or not os.path.isdir(kernel_sources) or not os.path.isfile(kernel_sources_downloaded_flag):
-        deleteAny(kernel_sources)
-        os.makedirs(kernel_sources, exist_ok=True)
+    if isKernelSourcesDownloadNeeded(url_hash):
+        kernel_sources = newKernelSources(url_hash)
         downloadFile(url, kernel_sources_archive)
         buildRawExecute(unpacker % (kernel_sources_archive, kernel_sources))
-        emptyFile(kernel_sources_downloaded_flag)
-    
-    return kernel_sources
+        setCurrentKernelSources(url_hash, kernel_sources)
+    return getCurrentKernelSources(url_hash)[0]
 
 def downloadKernelFromGit(item):
     url = item["kernel_source_git"]
+    url_hash = getKernelSourcesHash(item)
 
-    url_hash = hashlib.md5(url.encode('utf-8') + item.get("kernel_source_git_branch", "").encode('utf-8') + item.get("kernel_source_git_checkout", "").encode('utf-8')).hexdigest()
-    kernel_sources = pathConcat(path_temp_kernel_sources, url_hash)
-    kernel_sources_downloaded_flag = pathConcat(path_temp_kernel_sources, url_hash + ".downloaded")
-
-    if args.d or not os.path.isdir(kernel_sources) or not os.path.isfile(kernel_sources_downloaded_flag):
-        deleteAny(kernel_sources)
-        os.makedirs(kernel_sources, exist_ok=True)
+    if isKernelSourcesDownloadNeeded(url_hash):
+        kernel_sources = newKernelSources(url_hash)
         
         cmd = ["git", "clone"]
         if "kernel_source_git_branch" in item:
@@ -1082,29 +2279,186 @@ def downloadKernelFromGit(item):
         if "kernel_source_git_checkout" in item:
             buildExecute(["git", "checkout", item["kernel_source_git_checkout"]], True, None, kernel_sources)
 
-        emptyFile(kernel_sources_downloaded_flag)
-    
-    return kernel_sources
+        setCurrentKernelSources(url_hash, kernel_sources)
+    return getCurrentKernelSources(url_hash)[0]
 
-def copyKernel(item, kernel_sources):
+def getCopiedKernelPath(item, kernel_sources):
     patches_checksum = {"array": []}
     if "patches" in item:
         for file in item["patches"]:
             patches_checksum["array"].append(get_file_checksum(findItem(file)))
     patches_checksum = dictChecksum(patches_checksum)
 
-    copied_kernel_files = pathConcat(path_temp_kernel_build, hashlib.md5((kernel_sources + ":" + patches_checksum).encode("utf-8")).hexdigest())
-    copied_kernel_files_flag = pathConcat(copied_kernel_files, ".copied")
+    return pathConcat(path_temp_kernel_build, hashlib.md5((kernel_sources + ":" + patches_checksum).encode("utf-8")).hexdigest())
 
-    if not os.path.isdir(copied_kernel_files) or not os.path.isfile(copied_kernel_files_flag):
-        deleteDirectory(copied_kernel_files)
-        os.makedirs(copied_kernel_files, exist_ok=True)
-        copyItemFiles(kernel_sources, copied_kernel_files)
-        with open(copied_kernel_files_flag, "w") as f:
-            pass
-        return copied_kernel_files, True
+def getKernelTreeLayerPath(kernel_tree):
+    return kernel_tree + ".layer"
+
+def readKernelTreeState(kernel_tree):
+    state_path = pathConcat(getKernelTreeLayerPath(kernel_tree), "layer.json")
+    if not os.path.isfile(state_path):
+        return None
+    with open(state_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+def writeKernelTreeState(kernel_tree, state):
+    with open(pathConcat(getKernelTreeLayerPath(kernel_tree), "layer.json"), "w", encoding="utf-8") as f:
+        json.dump(state, f)
+
+def copyKernel(item, kernel_sources):
+    # the patched tree is an overlayfs over the downloaded sources: the patches and items copy up only the files they change
+    # if overlayfs cannot be mounted, the sources are copied (with reflinks, if the filesystem supports them)
+    kernel_tree = getCopiedKernelPath(item, kernel_sources)
+    layer_path = getKernelTreeLayerPath(kernel_tree)
+    os.makedirs(path_temp_kernel_build, exist_ok=True)
+    emptyFile(kernel_tree + ".used")
+
+    with layersLock:
+        state = readKernelTreeState(kernel_tree)
+        if state is not None:
+            if state.get("ready") and state.get("lower") == os.path.abspath(kernel_sources):
+                if os.path.ismount(kernel_tree) or mountLayer(kernel_tree, kernel_sources, layer_path):
+                    return kernel_tree, False
+            umountLayer(kernel_tree)
+            deleteDirectory(layer_path)
+        elif os.path.isfile(pathConcat(kernel_tree, ".copied")):
+            return kernel_tree, False
+
+        deleteDirectory(kernel_tree)
+        if mountLayer(kernel_tree, kernel_sources, layer_path):
+            writeKernelTreeState(kernel_tree, {"lower": os.path.abspath(kernel_sources), "ready": False})
+            return kernel_tree, True
+        deleteDirectory(layer_path)
+
+    buildLog("WARNING: failed to mount overlayfs, the kernel sources are copied")
+    deleteDirectory(kernel_tree)
+    os.makedirs(kernel_tree, exist_ok=True)
+    copyItemFiles(kernel_sources, kernel_tree)
+    return kernel_tree, True
+
+def markKernelTreeReady(kernel_tree):
+    # the tree is reused only after the patches have been applied to it
+    state = readKernelTreeState(kernel_tree)
+    if state is not None:
+        state["ready"] = True
+        writeKernelTreeState(kernel_tree, state)
+    else:
+        emptyFile(pathConcat(kernel_tree, ".copied"))
+
+def deleteKernelTree(kernel_tree):
+    umountLayer(kernel_tree)
+    for path in [kernel_tree, getKernelTreeLayerPath(kernel_tree), getKernelBuildPath(kernel_tree), kernel_tree + ".used"]:
+        deleteAny(path)
+
+def isLowerLayerMounted(lowerPath):
+    # checks the mounts of all processes, including the other syslbuild processes (--parallel-arch)
+    lowerPath = os.path.abspath(lowerPath)
+    for char, escaped in [("\\", "\\134"), (" ", "\\040"), ("\t", "\\011"), ("\n", "\\012")]:
+        lowerPath = lowerPath.replace(char, escaped)
+    with open("/proc/mounts", "r") as f:
+        for line in f:
+            fields = line.split()
+            if len(fields) < 4 or fields[2] != "overlay":
+                continue
+            for option in fields[3].split(","):
+                if option.startswith("lowerdir=") and lowerPath in option[len("lowerdir="):].split(":"):
+                    return True
+    return False
 
-    return copied_kernel_files, False
+def getKernelSourcesHashOfPath(kernel_sources):
+    return os.path.basename(os.path.abspath(kernel_sources)).split("-")[0]
+
+def deleteOldKernelSources():
+    # the trees over the previous downloads of the sources and the previous downloads themselves are deleted once nothing uses them
+    # everything is skipped if the sources are being downloaded or mounted right now (the lock is held)
+    if not os.path.isdir(path_temp_kernel_sources):
+        return
+
+    oldTrees = {}
+    if os.path.isdir(path_temp_kernel_build):
+        for entry in os.scandir(path_temp_kernel_build):
+            if not entry.is_dir() or "." in entry.name:
+                continue
+            kernel_tree = pathConcat(path_temp_kernel_build, entry.name)
+            state = readKernelTreeState(kernel_tree)
+            if state is not None and state.get("lower"):
+                oldTrees.setdefault(getKernelSourcesHashOfPath(state["lower"]), []).append((kernel_tree, state["lower"]))
+
+    sources = {}
+    for entry in os.scandir(path_temp_kernel_sources):
+        if entry.is_dir():
+            sources.setdefault(getKernelSourcesHashOfPath(entry.name), []).append(pathConcat(path_temp_kernel_sources, entry.name))
+
+    for sources_hash in set(oldTrees) | set(sources):
+        with fileLock(getKernelSourcesLockPath(sources_hash), blocking=False) as locked:
+            if not locked:
+                continue
+
+            current = getCurrentKernelSources(sources_hash)[0]
+            if current is None:
+                continue
+            current = os.path.abspath(current)
+
+            for kernel_tree, lowerPath in oldTrees.get(sources_hash, []):
+                if os.path.abspath(lowerPath) == current:
+                    continue
+                # the trees mounted by other syslbuild processes are left to them
+                if os.path.ismount(kernel_tree) and os.path.abspath(kernel_tree) not in mountedLayers:
+                    continue
+                lock = getNamedLock(kernel_tree)
+                if not lock.acquire(blocking=False):
+                    continue
+                try:
+                    buildLog(f"Kernel build: deleting the kernel tree {os.path.basename(kernel_tree)} of the previous kernel sources")
+                    deleteKernelTree(kernel_tree)
+                finally:
+                    lock.release()
+
+            for kernel_sources in sources.get(sources_hash, []):
+                if os.path.abspath(kernel_sources) == current or isLowerLayerMounted(kernel_sources):
+                    continue
+                buildLog(f"Kernel build: deleting the previous kernel sources {os.path.basename(kernel_sources)}")
+                deleteAny(kernel_sources)
+                deleteAny(kernel_sources + ".downloaded")
+
+def evictKernelTrees(keep_tree):
+    deleteOldKernelSources()
+
+    # the least recently used kernel trees (with their objects) are deleted when they take more than --kernel-build-size
+    if not args.kernel_build_size or not os.path.isdir(path_temp_kernel_build):
+        return
+
+    limit = calcSize(args.kernel_build_size)
+    entries = []
+    total = 0
+    for entry in os.scandir(path_temp_kernel_build):
+        if not entry.is_dir() or "." in entry.name:
+            continue
+        kernel_tree = pathConcat(path_temp_kernel_build, entry.name)
+        size = getDiskUsage(getKernelTreeLayerPath(kernel_tree)) + getDiskUsage(getKernelBuildPath(kernel_tree))
+        if readKernelTreeState(kernel_tree) is None:
+            size += getDiskUsage(kernel_tree)
+        used_path = kernel_tree + ".used"
+        used = os.stat(used_path).st_mtime if os.path.isfile(used_path) else entry.stat().st_mtime
+        entries.append((used, kernel_tree, size))
+        total += size
+
+    for used, kernel_tree, size in sorted(entries):
+        if total <= limit:
+            break
+        if os.path.abspath(kernel_tree) == os.path.abspath(keep_tree) or os.path.ismount(kernel_tree):
+            continue
+
+        # the tree is not used by another builditem right now
+        lock = getNamedLock(kernel_tree)
+        if not lock.acquire(blocking=False):
+            continue
+        try:
+            buildLog(f"Kernel build: deleting the least recently used kernel tree {os.path.basename(kernel_tree)} ({formatBytes(size)})")
+            deleteKernelTree(kernel_tree)
+        finally:
+            lock.release()
+        total -= size
 
 def patchKernel(kernel_sources, patches, patches_ignore_errors=False):
     for patchPath in patches:
@@ -1129,31 +2483,71 @@ kernelArchitectureConfigs = {
 import os
 import subprocess
 
-def set_kernel_config_parameter(config_path, param, value):
-    with open(config_path, "r") as f:
-        lines = f.readlines()
-
-    new_lines = []
-    param_found = False
-    for line in lines:
-        if line.startswith(f"{param}=") or line.startswith(f"# {param} is not set"):
-            param_found = True
-            if value is None:
-                new_lines.append(f"# {param} is not set\n")
-            else:
-                new_lines.append(f"{param}={value}\n")
-        else:
-            new_lines.append(line)
-
-    if not param_found:
-        if value is not None:
-            new_lines.append(f"{param}={value}\n")
+KERNEL_CONFIG_LINE = re.compile(r"^(?:(\w+)=|# (\w+) is not set)")
 
+def read_kernel_config(config_path):
+    # the lines of the config and the index of the lines of every symbol, so a change does not scan the whole file
+    config = {"lines": [], "index": {}}
+    with open(config_path, "r") as f:
+        for line in f:
+            if not line.endswith("\n"):
+                line += "\n"
+            match = KERNEL_CONFIG_LINE.match(line)
+            if match:
+                config["index"].setdefault(match.group(1) or match.group(2), []).append(len(config["lines"]))
+            config["lines"].append(line)
+    return config
+
+def write_kernel_config(config, config_path):
     with open(config_path, "w") as f:
-        f.writelines(new_lines)
-
-def update_kernel_config(kernel_sources, ARCH_STR, CROSS_COMPILE_STR):
-    buildExecute(["make", ARCH_STR, CROSS_COMPILE_STR, "olddefconfig"], True, None, kernel_sources)
+        f.writelines(config["lines"])
+
+def format_kernel_config_parameter(param, value):
+    # "n" is written the way kconfig writes it, so it matches the config made by defconfig
+    if value is None or value == "n":
+        return f"# {param} is not set\n"
+    return f"{param}={value}\n"
+
+def set_kernel_config_parameter(config, param, value):
+    line = format_kernel_config_parameter(param, value)
+    if param not in config["index"]:
+        # "is not set" is an explicit choice for kconfig too, without it olddefconfig would enable a symbol that is enabled by default
+        config["index"][param] = [len(config["lines"])]
+        config["lines"].append(line)
+        return
+
+    for index in config["index"][param]:
+        config["lines"][index] = line
+
+def apply_kernel_config_changes(config_path, changes):
+    # changes is a list of [param, value, source], all of them are applied with one read and one write of the config
+    # returns the list of the changed symbols
+    config = read_kernel_config(config_path)
+    original_lines = list(config["lines"])
+    sources = {}
+    for param, value, source in changes:
+        if param in sources and sources[param][0] != value:
+            buildLog(f"kernel config: {param}={sources[param][0]} ({sources[param][1]}) is overridden by {param}={value} ({source})")
+        sources[param] = (value, source)
+        set_kernel_config_parameter(config, param, value)
+
+    # a symbol changed by one change and restored by another is not changed
+    changed = [param for param in sources if any(index >= len(original_lines) or config["lines"][index] != original_lines[index] for index in config["index"].get(param, []))]
+    if changed:
+        write_kernel_config(config, config_path)
+        buildLog(f"kernel config: {len(changed)} symbols changed: {' '.join(changed)}")
+    return changed
+
+def get_kernel_config_digest(config_path):
+    # the digest of the set symbols only, it does not depend on comments and the order of the lines
+    config = read_kernel_config(config_path)
+    symbols = {}
+    for param, indexes in config["index"].items():
+        symbols[param] = config["lines"][indexes[-1]]
+    return dictChecksum({"symbols": sorted(symbols.values())})
+
+def update_kernel_config(kernel_sources, MAKE_ARGS, kernel_env=None):
+    buildExecute(["make"] + MAKE_ARGS + ["olddefconfig"], True, None, kernel_sources, kernel_env)
 
 def parse_kernel_config_changes(changes_file):
     with open(changes_file, "r") as f:
@@ -1170,99 +2564,215 @@ def parse_kernel_config_changes(changes_file):
         return changes
     return []
 
-def modifyKernelConfig(item, kernel_sources, ARCH_STR, CROSS_COMPILE_STR):
-    kernel_config_path = pathConcat(kernel_sources, ".config")
-
+def getKernelConfigChanges(item):
+    changes = []
     if "kernel_config_changes_files" in item:
         for changes_file in item["kernel_config_changes_files"]:
             for change in parse_kernel_config_changes(findItem(changes_file)):
-                set_kernel_config_parameter(kernel_config_path, change[0], change[1])
+                changes.append([change[0], change[1], changes_file])
 
     if "kernel_config_changes" in item:
         for change in item["kernel_config_changes"]:
-            set_kernel_config_parameter(kernel_config_path, change[0], change[1])
+            changes.append([change[0], change[1], "kernel_config_changes"])
 
     if not item.get("kernel_config_disable_default_changes", False):
         # I'm disabling this for some patches to work correctly
-        set_kernel_config_parameter(kernel_config_path, "CONFIG_WERROR", "n")
+        changes.append(["CONFIG_WERROR", "n", "default changes"])
 
-        set_kernel_config_parameter(kernel_config_path, "CONFIG_RD_GZIP", "y")
-    
-    update_kernel_config(kernel_sources, ARCH_STR, CROSS_COMPILE_STR)
+        changes.append(["CONFIG_RD_GZIP", "y", "default changes"])
+
+    return changes
+
+def getKernelConfigChangesDigest(item):
+    # the resulting values of the changes, so comments and reordered fragments do not change the digest
+    values = {}
+    for param, value, source in getKernelConfigChanges(item):
+        values[param] = format_kernel_config_parameter(param, value)
+    return dictChecksum({"values": sorted(values.values())})
+
+def modifyKernelConfig(item, kernel_sources, kernel_config_path, MAKE_ARGS, kernel_env=None, config_copied=False):
+    changed = apply_kernel_config_changes(kernel_config_path, getKernelConfigChanges(item))
 
-def additionalExportProcess(export_from, additional_export_list):
+    # the config made by defconfig is already resolved, a copied config can be made for other sources
+    if changed or config_copied:
+        update_kernel_config(kernel_sources, MAKE_ARGS, kernel_env)
+    else:
+        buildLog("the kernel config changes are already applied, olddefconfig is skipped")
+
+def additionalExportProcess(export_from_list, additional_export_list):
+    # the object is taken from the first directory where it exists
     for additional_export_item in additional_export_list:
-        object_path = pathConcat(export_from, additional_export_item[0])
+        for export_from in export_from_list:
+            object_path = pathConcat(export_from, additional_export_item[0])
+            if os.path.exists(object_path):
+                break
         copyItemFiles(object_path, getCustomItemPath(additional_export_item[1], additional_export_item[2]))
 
 def buildKernel(item):
-    if "kernel_source_url" in item:
-        downloaded_kernel_sources = downloadKernel(
-            item["kernel_source_url"],
-            item.get("kernel_source_unpacker", "tar -xJf %s -C %s --strip-components=1")
-        )
-    elif "kernel_source_git" in item:
-        downloaded_kernel_sources = downloadKernelFromGit(item)
-    else:
+    if "kernel_source_url" not in item and "kernel_source_git" not in item:
         buildLog("ERROR: it is impossible to build a kernel without specifying the source code download source")
         sys.exit(1)
 
-    kernel_sources, realCopied = copyKernel(item, downloaded_kernel_sources)
+    # the sources are downloaded and the tree is mounted over them under the lock of the sources,
+    # after that the mount keeps the sources from being deleted by evictKernelTrees of other builditems and processes
+    with fileLock(getKernelSourcesLockPath(getKernelSourcesHash(item))):
+        if "kernel_source_url" in item:
+            downloaded_kernel_sources = downloadKernel(
+                item["kernel_source_url"],
+                item.get("kernel_source_unpacker", "tar -xJf %s -C %s --strip-components=1")
+            )
+        else:
+            downloaded_kernel_sources = downloadKernelFromGit(item)
+
+        # kernel items with the same sources and patches share one build tree
+        kernel_tree = getCopiedKernelPath(item, downloaded_kernel_sources)
+        tree_lock = getNamedLock(kernel_tree)
+        tree_lock.acquire()
+        try:
+            kernel_tree, realCopied = copyKernel(item, downloaded_kernel_sources)
+        except BaseException:
+            tree_lock.release()
+            raise
 
-    if "items" in item:
-        rawItemsProcess(item["items"], kernel_sources)
+    try:
+        buildKernelTree(item, kernel_tree, realCopied)
+    finally:
+        tree_lock.release()
+    evictKernelTrees(kernel_tree)
+
+def getKernelBuildPath(kernel_sources):
+    # the objects are built out of tree (O=) and kept between builds, so the changed kernel is rebuilt incrementally
+    return kernel_sources + ".build"
+
+# the paths of these items are relative to the build directory: the config and the paths of the signing keys and certificates options
+KERNEL_BUILD_ITEM_PATHS = [".config", "include/config", "certs"]
 
-    if realCopied and "patches" in item:
-        patchKernel(kernel_sources, item["patches"], item.get("patches_ignore_errors", False))
+def isKernelBuildItemPath(itemPath):
+    itemPath = os.path.normpath(itemPath).lstrip("/")
+    return any(itemPath == path or itemPath.startswith(path + "/") for path in KERNEL_BUILD_ITEM_PATHS)
+
+def isKernelTreeBuiltInPlace(kernel_sources):
+    return os.path.exists(pathConcat(kernel_sources, ".config")) or os.path.isdir(pathConcat(kernel_sources, "include", "config"))
+
+def getKernelCcacheEnv(item):
+    if not item.get("ccache", True) or not shutil.which("ccache"):
+        return None
+
+    os.makedirs(path_temp_ccache, exist_ok=True)
+    return {
+        "CCACHE_DIR": os.path.abspath(path_temp_ccache),
+        "CCACHE_BASEDIR": os.path.abspath(path_temp_kernel_build)
+    }
+
+def getKernelConfigKey(item, DEFCONFIG_NAME, MAKE_ARGS):
+    # everything that the resulting .config depends on (the sources and patches are the same for the whole build directory)
+    return dictChecksum({
+        "defconfig": DEFCONFIG_NAME,
+        "make": MAKE_ARGS[1:],
+        "kernel_config": get_file_checksum(findItem(item["kernel_config"])) if "kernel_config" in item else None,
+        "kernel_config_changes": getKernelConfigChangesDigest(item),
+        "items": [[getDependenciesFileOrDirectoryChecksum(findItem(itemObj[0])), itemObj[1:]] for itemObj in item.get("items", [])]
+    })
+
+def getKernelConfigStatePath(kernel_build):
+    return pathConcat(kernel_build, ".syslbuild_config")
+
+def isKernelConfigCurrent(kernel_build, config_key):
+    kernel_config_path = pathConcat(kernel_build, ".config")
+    state_path = getKernelConfigStatePath(kernel_build)
+    if not os.path.isfile(kernel_config_path) or not os.path.isfile(state_path):
+        return False
+
+    with open(state_path) as f:
+        state = json.load(f)
+    return state.get("key") == config_key and state.get("config") == get_kernel_config_digest(kernel_config_path)
+
+def buildKernelTree(item, kernel_sources, realCopied):
+    kernel_build = getKernelBuildPath(kernel_sources)
+    if realCopied:
+        deleteAny(kernel_build)
+    os.makedirs(kernel_build, exist_ok=True)
 
     ARCH = kernelArchitectures[architecture]
     CROSS_COMPILE = gccNames[architecture]
     ARCH_STR = f"ARCH={ARCH}"
     CROSS_COMPILE_STR = f"CROSS_COMPILE={CROSS_COMPILE}-"
     DEFCONFIG_NAME = item.get("defconfig", kernelArchitectureConfigs.get(architecture, "defconfig"))
-    buildExecute(["make", ARCH_STR, CROSS_COMPILE_STR, DEFCONFIG_NAME], True, None, kernel_sources)
 
-    kernel_config_path = pathConcat(kernel_sources, ".config")
+    if isKernelTreeBuiltInPlace(kernel_sources):
+        # the tree was built in place by an older version of syslbuild, but O= requires clean sources
+        # mrproper deletes .config and the signing keys, so it is done before the items are copied into the tree
+        buildExecute(["make", ARCH_STR, "mrproper"], True, None, kernel_sources)
 
-    if "kernel_config" in item:
-        copyItemFiles(findItem(item["kernel_config"]), kernel_config_path)
+    if "items" in item:
+        # the items for the build directory would make the sources unclean for O= (and trigger mrproper in the next build)
+        sourcesItems = [itemObj for itemObj in item["items"] if not isKernelBuildItemPath(itemObj[1])]
+        buildItems = [itemObj for itemObj in item["items"] if isKernelBuildItemPath(itemObj[1])]
+        rawItemsProcess(sourcesItems, kernel_sources)
+        rawItemsProcess(buildItems, kernel_build)
+
+    if realCopied:
+        if "patches" in item:
+            patchKernel(kernel_sources, item["patches"], item.get("patches_ignore_errors", False))
+        markKernelTreeReady(kernel_sources)
+
+    kernel_env = getKernelCcacheEnv(item)
+    MAKE_ARGS = [f"O={os.path.abspath(kernel_build)}", ARCH_STR, CROSS_COMPILE_STR]
+    if kernel_env:
+        MAKE_ARGS += [f"CC=ccache {CROSS_COMPILE}-gcc", "HOSTCC=ccache gcc"]
+
+    kernel_config_path = pathConcat(kernel_build, ".config")
+    config_key = getKernelConfigKey(item, DEFCONFIG_NAME, MAKE_ARGS)
+    if isKernelConfigCurrent(kernel_build, config_key):
+        buildLog("the kernel config has not changed, defconfig and olddefconfig are skipped")
+    else:
+        deleteAny(getKernelConfigStatePath(kernel_build))
+        buildExecute(["make"] + MAKE_ARGS + [DEFCONFIG_NAME], True, None, kernel_sources, kernel_env)
+
+        if "kernel_config" in item:
+            copyItemFiles(findItem(item["kernel_config"]), kernel_config_path)
+
+        modifyKernelConfig(item, kernel_sources, kernel_config_path, MAKE_ARGS, kernel_env, "kernel_config" in item)
+        with open(getKernelConfigStatePath(kernel_build), "w") as f:
+            json.dump({"key": config_key, "config": get_kernel_config_digest(kernel_config_path)}, f)
 
-    modifyKernelConfig(item, kernel_sources, ARCH_STR, CROSS_COMPILE_STR)
-    buildExecute(["make", ARCH_STR, CROSS_COMPILE_STR, "modules_prepare"], True, None, kernel_sources)
+    buildExecute(["make"] + MAKE_ARGS + ["modules_prepare"], True, None, kernel_sources, kernel_env, jobserver=True)
 
     if "result_config_name" in item:
         buildLog(f"exporting result kernel config...")
         export_path = getItemPath(item, "result_config_name", "result_config_export")
         copyItemFiles(kernel_config_path, export_path)
 
-    buildRawExecute(f"make {ARCH_STR} {CROSS_COMPILE_STR} -j$(nproc)", True, kernel_sources)
+    # the number of jobs is limited by the CPU budget (--cpus) shared with the other builditems
+    buildRawExecute(f"make {" ".join(shlex.quote(arg) for arg in MAKE_ARGS)}", True, kernel_sources, env=kernel_env, jobserver=True)
 
     kernel_output_filename = item.get("kernel_output_file", "bzImage")
-    kernel_output_file = pathConcat(kernel_sources, "arch", kernelArchitectures[architecture], "boot", kernel_output_filename)
-    if os.path.isfile(kernel_output_file):
-        copyItemFiles(kernel_output_file, getItemPath(item))
-    else:
-        kernel_output_file = pathConcat(kernel_sources, kernel_output_filename)
+    for kernel_output_file in [
+        pathConcat(kernel_build, "arch", ARCH, "boot", kernel_output_filename),
+        pathConcat(kernel_build, kernel_output_filename),
+        pathConcat(kernel_sources, kernel_output_filename)
+    ]:
         if os.path.isfile(kernel_output_file):
             copyItemFiles(kernel_output_file, getItemPath(item))
-        else:
-            buildLog(f"ERROR: failed to find \"{kernel_output_filename}\" kernel output file")
-            sys.exit(1)
+            break
+    else:
+        buildLog(f"ERROR: failed to find \"{kernel_output_filename}\" kernel output file")
+        sys.exit(1)
 
     if "modules_name" in item:
         buildLog(f"exporting modules...")
         export_path = getItemFolder(item, "modules_name", "modules_export")
-        buildExecute(["make", ARCH_STR, CROSS_COMPILE_STR, "modules_install", f"INSTALL_MOD_PATH={os.path.abspath(export_path)}"], True, None, kernel_sources)
+        buildExecute(["make"] + MAKE_ARGS + ["modules_install", f"INSTALL_MOD_PATH={os.path.abspath(export_path)}"], True, None, kernel_sources, kernel_env, jobserver=True)
         recursionDeleleSymlinks(export_path)
 
     if "headers_name" in item:
         buildLog(f"exporting headers...")
         export_path = getItemFolder(item, "headers_name", "headers_export")
-        buildExecute(["make", ARCH_STR, CROSS_COMPILE_STR, "headers_install", f"INSTALL_HDR_PATH={os.path.abspath(export_path)}"], True, None, kernel_sources)
+        buildExecute(["make"] + MAKE_ARGS + ["headers_install", f"INSTALL_HDR_PATH={os.path.abspath(export_path)}"], True, None, kernel_sources, kernel_env, jobserver=True)
         recursionDeleleSymlinks(export_path)
 
     if "additional_export" in item:
-        additionalExportProcess(kernel_sources, item["additional_export"])
+        additionalExportProcess([kernel_build, kernel_sources], item["additional_export"])
 
 def get_host_arch():
     m = platform.machine().lower()
@@ -1346,6 +2856,8 @@ def rawCrossChroot(chrootDirectory, chrootCommand, useSystemd=False, manualValid
     checkValid = not manualValidation
     if useSystemd:
         machineName = "smartchroot"
+        if getWorkerName() is not None:
+            machineName += "-" + getWorkerName()
         buildRawExecute(f"""systemd-nspawn --boot --machine={machineName} --directory="{chrootDirectory}" &
 CONTAINER_PID=$!
 sleep 20
@@ -1355,7 +2867,8 @@ machinectl terminate {machineName}
 sleep 2
 wait $CONTAINER_PID""", checkValid)
     else:
-        buildExecute(["chroot", chrootDirectory] + chrootCommand, checkValid)
+        # make in the chroot script uses the CPU budget of the build
+        buildExecute(["chroot", chrootDirectory] + chrootCommand, checkValid, jobserver=True)
 
     if boolCopyQemuStatic:
         deleteAny(qemuStaticPath)
@@ -1392,13 +2905,11 @@ def getKernelVersion(item, rootfsPath):
         sys.exit(1)
 
 def debianUpdateInitramfs(item):
-    itemPath = getItemFolder(item)
-    copyItemFiles(findItem(item["source"]), itemPath)
+    itemPath = getDerivedItemFolder(item, findItem(item["source"]))
     rawUpdateInitramfs(itemPath, getKernelVersion(item, itemPath))
 
 def debianExportInitramfs(item):
-    tempRootfs = getTempFolder("export_initramfs_rootfs")
-    copyItemFiles(findItem(item["source"]), tempRootfs)
+    tempRootfs = getTempLayerFolder("export_initramfs_rootfs", findItem(item["source"]))
 
     kernel_version = getKernelVersion(item, tempRootfs)
 
@@ -1429,9 +2940,10 @@ def debianExportInitramfs(item):
             copyItemFiles(initramfsPath, exportInitramfsPath, DEFAULT_RIGHTS_0755)
             break
 
+    umountLayer(tempRootfs)
+
 def smartChroot(item):
-    itemPath = getItemFolder(item)
-    copyItemFiles(findItem(item["source"]), itemPath)
+    itemPath = getDerivedItemFolder(item, findItem(item["source"]))
     for scriptPath in item["scripts"]:
         chroot_script_path = pathConcat(itemPath, ".syslbuild-smart-chroot.sh")
         copyItemFiles(scriptPath, chroot_script_path, DEFAULT_RIGHTS_0755)
@@ -1611,33 +3123,401 @@ buildActions = {
     "debian-update-initramfs": debianUpdateInitramfs,
     "debian-export-initramfs": debianExportInitramfs,
     "smart-chroot": smartChroot,
+    "debian-derive": debianDerive,
     "singleboard": singleboardBuild,
     "gitclone": gitcloneBuild
 }
 
-def get_file_checksum(file_path, hash_algo="sha256"):
-    h = hashlib.new(hash_algo)
+# checksums of files that have not changed since the last calculation are not recalculated
+# the file is considered unchanged if its (device, inode, size, mtime_ns, ctime_ns) have not changed
+# the checksums are kept in memory for the entire lifetime of the process (useful for the Build api)
+# and in .temp/file_hash_index.sqlite between runs
+fileChecksumCache = {}
+fileChecksumCacheNew = {}
+fileChecksumCacheLock = threading.Lock()
+loadedFileHashIndexes = set()
+
+# files modified less than this time ago are not saved to the index, their mtime may not change with the next modification
+FILE_HASH_INDEX_RACY_TIME_NS = 2 * 1000 * 1000 * 1000
+
+def openFileHashIndex():
+    connection = sqlite3.connect(path_file_hash_index, timeout=120)
+    connection.execute("CREATE TABLE IF NOT EXISTS file_hashes (path TEXT, algo TEXT, dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, ctime_ns INTEGER, checksum TEXT, PRIMARY KEY (path, algo))")
+    return connection
+
+def loadFileHashIndex():
+    if path_file_hash_index in loadedFileHashIndexes:
+        return
+
+    try:
+        connection = openFileHashIndex()
+        try:
+            rows = connection.execute("SELECT path, algo, dev, ino, size, mtime_ns, ctime_ns, checksum FROM file_hashes").fetchall()
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        buildLog(f"WARNING: failed to load the file hash index: {e}")
+        return
+
+    with fileChecksumCacheLock:
+        for path, algo, dev, ino, size, mtime_ns, ctime_ns, checksum in rows:
+            if (path, algo) not in fileChecksumCache:
+                fileChecksumCache[(path, algo)] = ((dev, ino, size, mtime_ns, ctime_ns), checksum)
+    loadedFileHashIndexes.add(path_file_hash_index)
+
+def saveFileHashIndex():
+    with fileChecksumCacheLock:
+        newEntries = list(fileChecksumCacheNew.items())
+        fileChecksumCacheNew.clear()
+
+    try:
+        connection = openFileHashIndex()
+        try:
+            with connection:
+                connection.executemany(
+                    "INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(path, algo) + fileStamp + (checksum,) for (path, algo), (fileStamp, checksum) in newEntries]
+                )
+
+                # the files that no longer exist are removed from the index
+                deletedPaths = []
+                for (path,) in connection.execute("SELECT DISTINCT path FROM file_hashes"):
+                    if not os.path.exists(path):
+                        deletedPaths.append((path,))
+                connection.executemany("DELETE FROM file_hashes WHERE path = ?", deletedPaths)
+        finally:
+            connection.close()
+    except sqlite3.Error as e:
+        buildLog(f"WARNING: failed to save the file hash index: {e}")
+
+# the checksum algorithm of the project ("checksum-algorithm" in the project json)
+# blake2b is faster than sha256 on processors without sha extensions, blake3 requires the "blake3" python package
+checksumAlgorithm = "sha256"
+
+HASH_READ_SIZE = 1024 * 1024
+HASH_MMAP_THRESHOLD = 64 * 1024 * 1024
+HASH_THREADS = min(32, os.cpu_count() or 1)
+
+def newHash(hash_algo):
+    if hash_algo == "blake3":
+        if blake3 is None:
+            buildLog("ERROR: the blake3 checksum algorithm requires the \"blake3\" python package")
+            sys.exit(1)
+        return blake3.blake3()
+
+    try:
+        return hashlib.new(hash_algo)
+    except ValueError:
+        buildLog(f"ERROR: unknown checksum algorithm: {hash_algo}")
+        sys.exit(1)
+
+def getCachedFileChecksum(file_path, hash_algo):
     try:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                h.update(chunk)
+        stat_result = os.stat(file_path)
     except OSError:
+        return None, None
+
+    fileStamp = (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ctime_ns)
+    cached = fileChecksumCache.get((os.path.abspath(file_path), hash_algo))
+    if cached and cached[0] == fileStamp:
+        return cached[1], stat_result
+    return None, stat_result
+
+hashBuffers = threading.local()
+
+def hashFile(file_path, hash_algo, stat_result):
+    # hashlib releases the GIL while hashing large blocks, so files can be hashed in several threads
+    h = newHash(hash_algo)
+    with open(file_path, "rb") as f:
+        if stat_result.st_size <= HASH_READ_SIZE:
+            h.update(f.read())
+        elif stat_result.st_size >= HASH_MMAP_THRESHOLD:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                h.update(mapped)
+        else:
+            if not hasattr(hashBuffers, "buffer"):
+                hashBuffers.buffer = bytearray(HASH_READ_SIZE)
+            view = memoryview(hashBuffers.buffer)
+            while True:
+                size = f.readinto(view)
+                if not size:
+                    break
+                h.update(view[:size])
+    return h.hexdigest()
+
+def calculateFileChecksum(file_path, hash_algo, stat_result):
+    try:
+        checksum = hashFile(file_path, hash_algo, stat_result)
+    except (OSError, ValueError):
         return "failed_checksum"
 
-    return h.hexdigest()
+    fileStamp = (stat_result.st_dev, stat_result.st_ino, stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ctime_ns)
+    cacheKey = (os.path.abspath(file_path), hash_algo)
+    with fileChecksumCacheLock:
+        fileChecksumCache[cacheKey] = (fileStamp, checksum)
+        if time.time_ns() - stat_result.st_mtime_ns > FILE_HASH_INDEX_RACY_TIME_NS:
+            fileChecksumCacheNew[cacheKey] = (fileStamp, checksum)
+    return checksum
+
+def get_file_checksum(file_path, hash_algo=None):
+    hash_algo = hash_algo or checksumAlgorithm
+    checksum, stat_result = getCachedFileChecksum(file_path, hash_algo)
+    if checksum:
+        return checksum
+    if stat_result is None:
+        return "failed_checksum"
+    return calculateFileChecksum(file_path, hash_algo, stat_result)
 
+def runHashThreads(func, argsList):
+    if HASH_THREADS > 1 and len(argsList) > 1:
+        with concurrent.futures.ThreadPoolExecutor(max_workers=HASH_THREADS) as executor:
+            futures = [executor.submit(func, *funcArgs) for funcArgs in argsList]
+            return [future.result() for future in futures]
+    return [func(*funcArgs) for funcArgs in argsList]
+
+def get_dir_checksum(dir_path, hash_algo=None):
+    hash_algo = hash_algo or checksumAlgorithm
 
-def get_dir_checksum(dir_path, hash_algo="sha256"):
     # создаём хэш от всех файлов в директории
-    h = hashlib.new(hash_algo)
+    file_paths = []
     for root, dirs, files in os.walk(dir_path):
         for name in sorted(files):  # сортировка для стабильности
-            file_path = os.path.join(root, name)
-            h.update(file_path.encode())  # путь влияет на хэш
-            h.update(get_file_checksum(file_path, hash_algo).encode())
+            file_paths.append(os.path.join(root, name))
+
+    # files that are not in the cache are hashed in several threads
+    checksums = {}
+    uncached = []
+    for file_path in file_paths:
+        checksum, stat_result = getCachedFileChecksum(file_path, hash_algo)
+        if checksum:
+            checksums[file_path] = checksum
+        elif stat_result is None:
+            checksums[file_path] = "failed_checksum"
+        else:
+            uncached.append((file_path, stat_result))
+
+    results = runHashThreads(lambda file_path, stat_result: calculateFileChecksum(file_path, hash_algo, stat_result), uncached)
+    for (file_path, stat_result), checksum in zip(uncached, results):
+        checksums[file_path] = checksum
+
+    h = newHash(hash_algo)
+    for file_path in file_paths:
+        h.update(file_path.encode())  # путь влияет на хэш
+        h.update(checksums[file_path].encode())
+    return h.hexdigest()
+
+# the manifest of the builditem result is written once after the build: the list of files with sizes, allocated blocks, modes, owners and checksums
+# getSize, getDiskUsage, the checksums of paths inside the builditems and copyItemFiles read it instead of walking the result again
+# entry: [relative path, kind, mode, uid, gid, size, allocated bytes, digest, xattrs]
+# the digest of a directory is calculated from the names, kinds, modes, owners, xattrs and digests of its entries (merkle tree)
+# xattrs are a part of it, so a builditem that only adds file capabilities or ACLs rebuilds its dependents
+MANIFEST_VERSION = 2
+
+outputManifestsCache = {}
+
+def getOutputManifestPath(outputName):
+    return pathConcat(path_build_manifests, normalizeItemReference(outputName) + ".json")
+
+def getEntryKind(mode):
+    if stat.S_ISREG(mode):
+        return "f"
+    elif stat.S_ISDIR(mode):
+        return "d"
+    elif stat.S_ISLNK(mode):
+        return "l"
+    return "o"
+
+def getEntryXattrs(path):
+    # sorted [name, hex value] pairs of the entry itself (not of the symlink target)
+    try:
+        names = os.listxattr(path, follow_symlinks=False)
+    except OSError:
+        return []
+
+    xattrs = []
+    for name in sorted(names):
+        try:
+            xattrs.append([name, os.getxattr(path, name, follow_symlinks=False).hex()])
+        except OSError:
+            continue
+    return xattrs
+
+def formatEntryXattrs(xattrs):
+    return ",".join(f"{name}={value}" for name, value in xattrs)
+
+def getEntryDigest(hash_algo, kind, path, stat_result, children=None):
+    h = newHash(hash_algo)
+    if kind == "d":
+        for child in children:
+            h.update(os.fsencode(os.path.basename(child[0])) + b"\0")
+            h.update(f"{child[1]}\0{child[2]:o}\0{child[3]}\0{child[4]}\0{child[7]}\0{formatEntryXattrs(child[8])}\n".encode())
+    elif kind == "l":
+        h.update(os.fsencode(os.readlink(path)))
+    elif kind == "o":
+        h.update(f"{stat.S_IFMT(stat_result.st_mode)}:{stat_result.st_rdev}".encode())
     return h.hexdigest()
 
-def getDependenciesFileOrDirectoryChecksum(pathOrChecksum, hash_algo="sha256"):
+def scanOutput(path, hash_algo):
+    # the only walk over the builditem result
+    root_stat = os.lstat(path)
+    entries = [[".", getEntryKind(root_stat.st_mode), stat.S_IMODE(root_stat.st_mode), root_stat.st_uid, root_stat.st_gid, root_stat.st_size, root_stat.st_blocks * 512, None, getEntryXattrs(path)]]
+    paths = [path]
+    stats = [root_stat]
+    size = 0
+
+    if entries[0][1] == "d":
+        for root, dirs, files in os.walk(path, followlinks=False):
+            dirs.sort()
+            for name in sorted(dirs + files):
+                entryPath = os.path.join(root, name)
+                try:
+                    entry_stat = os.lstat(entryPath)
+                except FileNotFoundError:
+                    continue
+                kind = getEntryKind(entry_stat.st_mode)
+                entries.append([os.path.relpath(entryPath, path), kind, stat.S_IMODE(entry_stat.st_mode), entry_stat.st_uid, entry_stat.st_gid, entry_stat.st_size, entry_stat.st_blocks * 512, None, getEntryXattrs(entryPath)])
+                paths.append(entryPath)
+                stats.append(entry_stat)
+
+                # the same as getSize: files and symlinks to anything other than directories, by the size of the target
+                if kind == "f":
+                    size += entry_stat.st_size
+                elif kind == "l" and not os.path.isdir(entryPath):
+                    try:
+                        size += os.path.getsize(entryPath)
+                    except OSError:
+                        pass
+        diskUsage = sum(entry[6] for entry in entries[1:])
+    else:
+        size = root_stat.st_size if entries[0][1] == "f" else 0
+        diskUsage = root_stat.st_blocks * 512
+
+    def hashEntry(index):
+        try:
+            return hashFile(paths[index], hash_algo, stats[index])
+        except (OSError, ValueError):
+            return "failed_checksum"
+
+    files = [index for index, entry in enumerate(entries) if entry[1] == "f"]
+    for index, digest in zip(files, runHashThreads(hashEntry, [(index,) for index in files])):
+        entries[index][7] = digest
+
+    # the directories are processed from the deepest, so the digests of their entries are already known
+    children = {}
+    for index in range(len(entries) - 1, -1, -1):
+        entry = entries[index]
+        if entry[1] != "f":
+            entry[7] = getEntryDigest(hash_algo, entry[1], paths[index], stats[index], reversed(children.pop(entry[0], [])))
+        if index > 0:
+            children.setdefault(os.path.dirname(entry[0]) or ".", []).append(entry)
+
+    return root_stat, entries, size, diskUsage
+
+def writeItemManifests(item, checksum):
+    for role, outputPath, export in getItemOutputs(item):
+        if not os.path.lexists(outputPath):
+            continue
+
+        root_stat, entries, size, diskUsage = scanOutput(outputPath, checksumAlgorithm)
+        layerName = getLayerOutputName(outputPath)
+        if layerName:
+            # only the changes take up space
+            diskUsage = getDiskUsage(pathConcat(getItemLayerPath(layerName), "upper"))
+        manifest = {
+            "version": MANIFEST_VERSION,
+            "item": item["name"],
+            "checksum": checksum,
+            "path": os.path.abspath(outputPath),
+            "stamp": getOutputStamp(outputPath),
+            "algorithm": checksumAlgorithm,
+            "digest": entries[0][7],
+            "size": size,
+            "diskUsage": diskUsage,
+            "entries": entries
+        }
+
+        manifestPath = getOutputManifestPath(os.path.relpath(outputPath, path_output_target if export else path_build))
+        os.makedirs(os.path.dirname(manifestPath), exist_ok=True)
+        with open(manifestPath + ".tmp", "w") as f:
+            json.dump(manifest, f)
+        os.replace(manifestPath + ".tmp", manifestPath)
+
+def deleteItemManifests(item):
+    for role, outputPath, export in getItemOutputs(item):
+        deleteFile(getOutputManifestPath(os.path.relpath(outputPath, path_output_target if export else path_build)))
+
+def getOutputStamp(outputPath):
+    # the layers are mounted again in each build, so the stamp of the layered result is taken from its upper layer
+    layerName = getLayerOutputName(outputPath)
+    if layerName:
+        outputPath = pathConcat(getItemLayerPath(layerName), "upper")
+    root_stat = os.lstat(outputPath)
+    return [root_stat.st_dev, root_stat.st_ino, root_stat.st_mtime_ns]
+
+def loadOutputManifest(manifestPath, outputPath):
+    try:
+        manifest_mtime = os.stat(manifestPath).st_mtime_ns
+        stamp = getOutputStamp(outputPath)
+    except OSError:
+        return None
+
+    cached = outputManifestsCache.get(manifestPath)
+    if cached and cached[0] == manifest_mtime:
+        manifest = cached[1]
+    else:
+        try:
+            with open(manifestPath, "r") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        outputManifestsCache[manifestPath] = (manifest_mtime, manifest)
+
+    # the manifest is only used if the result has not been rebuilt or replaced since it was written
+    if manifest.get("version") != MANIFEST_VERSION or manifest["path"] != os.path.abspath(outputPath):
+        return None
+    if manifest["stamp"] != stamp:
+        return None
+    if readCacheChecksumForName(manifest["item"]) != manifest["checksum"]:
+        return None
+    return manifest
+
+def findPathManifest(path):
+    # returns the manifest of the builditem result that contains the path and the path relative to the result
+    path = os.path.abspath(path)
+    for basePath in [path_build, path_output_target]:
+        basePath = os.path.abspath(basePath)
+        if not path.startswith(basePath + os.sep):
+            continue
+
+        outputName = os.path.relpath(path, basePath)
+        while outputName and outputName != ".":
+            manifestPath = getOutputManifestPath(outputName)
+            if os.path.exists(manifestPath):
+                manifest = loadOutputManifest(manifestPath, pathConcat(basePath, outputName))
+                if manifest:
+                    return manifest, os.path.relpath(path, pathConcat(basePath, outputName))
+                return None, None
+            outputName = os.path.dirname(outputName)
+    return None, None
+
+def findOutputManifest(path):
+    manifest, relpath = findPathManifest(path)
+    if manifest and relpath == ".":
+        return manifest
+    return None
+
+def getManifestEntryChecksum(entry):
+    # cp -a also copies the rights of the directory itself, so they are taken into account
+    return f"{entry[1]}:{entry[2]:o}:{entry[3]}:{entry[4]}:{entry[7]}:{formatEntryXattrs(entry[8])}"
+
+def getManifestEntries(manifest, relpath):
+    # the entry of the path and all the entries inside it
+    if relpath == ".":
+        return manifest["entries"]
+    prefix = relpath + os.sep
+    return [entry for entry in manifest["entries"] if entry[0] == relpath or entry[0].startswith(prefix)]
+
+def getDependenciesFileOrDirectoryChecksum(pathOrChecksum, hash_algo=None):
     if pathOrChecksum.startswith("@") or pathOrChecksum == "NOT CALCULATED":
         return pathOrChecksum
     
@@ -1654,12 +3534,20 @@ def getDependenciesFieldChecksum(fieldValue, filesOnly=False):
     def inlineFindItem(inputPath):
         if not filesOnly:
             if os.path.exists(pathConcat(path_build, inputPath)) or os.path.exists(pathConcat(path_output_target, inputPath)):
+                # early cutoff: the dependency is the content of the builditem result, not its checksum
+                # if the rebuilt builditem produced the same result, the builditems that use it are not rebuilt
+                # it also works for paths inside another builditem: "rootfs/boot/vmlinuz"
+                manifest, relpath = findPathManifest(findItem(inputPath))
+                if manifest:
+                    entries = getManifestEntries(manifest, relpath)
+                    if entries:
+                        return "@" + getManifestEntryChecksum(entries[0])
+
                 checksumPath = getItemChecksumPathFromName(inputPath)
                 if os.path.exists(checksumPath):
                     with open(checksumPath, "r") as f:
                         return "@" + f.read()
-                else:
-                    return "NOT CALCULATED"
+                return "NOT CALCULATED"
         return inputPath
 
     if isinstance(fieldValue, str):
@@ -1695,53 +3583,75 @@ def rawGetDependencies(item, items_and_files_fields=None, files_only_fields=None
 
     return dependencies
 
+# the fields in which builditems refer to other builditems or user files
+# these fields are used both for calculating the checksum and for building the builditems graph
+dependenciesItemsFields = {
+    "directory": ["items"],
+    "tar": ["source"],
+    "filesystem": ["source"],
+    "full-disk-image": ["partitions"],
+    "from-directory": ["source"],
+    "initramfs": ["source"],
+    "grub-iso-image": ["kernel", "initramfs", "config"],
+    "unpack-initramfs": ["initramfs"],
+    "kernel": ["patches", "kernel_config", "kernel_config_changes_files", "items"],
+    "debian-update-initramfs": ["source"],
+    "debian-export-initramfs": ["kernel_config", "source"],
+    "smart-chroot": ["scripts", "source"],
+    "debian-derive": ["source"],
+    "singleboard": ["bootloader", "initramfs", "kernel", "rootfs", "dtbList", "dtboList", "bootloaderDtb"]
+}
+
 def getDependenciesDebian(item):
     return rawGetDependencies(item, [], ["hook-directory"])
 
 def getDependenciesDirectory(item):
-    return rawGetDependencies(item, ["items"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["directory"], [])
 
 def getDependenciesTar(item):
-    return rawGetDependencies(item, ["source"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["tar"], [])
 
 def getDependenciesFilesystem(item):
-    return rawGetDependencies(item, ["source"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["filesystem"], [])
 
 def getDependenciesFullDiskImage(item):
-    dependencies = rawGetDependencies(item, ["partitions"], [])
+    dependencies = rawGetDependencies(item, dependenciesItemsFields["full-disk-image"], [])
     if item.get("bootloader", {}).get("config", None):
         dependencies.append(getDependenciesFieldChecksum(item["bootloader"]["config"], False))
     return dependencies
 
 def getDependenciesFromDirectory(item):
-    return rawGetDependencies(item, ["source"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["from-directory"], [])
 
 def getDependenciesGccBuild(item):
     return rawGetDependencies(item, [], ["sources-dirs"])
 
 def getDependenciesInitramfs(item):
-    return rawGetDependencies(item, ["source"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["initramfs"], [])
 
 def getDependenciesGrubIsoImage(item):
-    return rawGetDependencies(item, ["kernel", "initramfs", "config"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["grub-iso-image"], [])
 
 def getDependenciesUnpackInitramfs(item):
-    return rawGetDependencies(item, ["initramfs"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["unpack-initramfs"], [])
 
 def getDependenciesKernel(item):
-    return rawGetDependencies(item, ["patches", "kernel_config", "kernel_config_changes_files", "items"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["kernel"], [])
 
 def getDependenciesDebianUpdateInitramfs(item):
-    return rawGetDependencies(item, ["source"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["debian-update-initramfs"], [])
 
 def getDependenciesDebianExportInitramfs(item):
-    return rawGetDependencies(item, ["kernel_config", "source"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["debian-export-initramfs"], [])
 
 def getDependenciesSmartChroot(item):
-    return rawGetDependencies(item, ["scripts", "source"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["smart-chroot"], [])
+
+def getDependenciesDebianDerive(item):
+    return rawGetDependencies(item, dependenciesItemsFields["debian-derive"], ["hook-directory"])
 
 def getDependenciesSingleboard(item):
-    return rawGetDependencies(item, ["bootloader", "initramfs", "kernel", "rootfs", "dtbList", "dtboList", "bootloaderDtb"], [])
+    return rawGetDependencies(item, dependenciesItemsFields["singleboard"], [])
 
 getDependencies = {
     "debian": getDependenciesDebian,
@@ -1758,6 +3668,7 @@ getDependencies = {
     "debian-update-initramfs": getDependenciesDebianUpdateInitramfs,
     "debian-export-initramfs": getDependenciesDebianExportInitramfs,
     "smart-chroot": getDependenciesSmartChroot,
+    "debian-derive": getDependenciesDebianDerive,
     "singleboard": getDependenciesSingleboard
 }
 
@@ -1770,11 +3681,14 @@ def dictChecksum(tbl):
     filtered = filter_underscored(tbl)
     return hashlib.md5(json5.dumps(filtered).encode('utf-8')).hexdigest()
 
-def getItemChecksum(item):
+def getItemDependencies(item):
     if item["type"] in getDependencies:
-        dependencies = getDependencies[item["type"]](item)
-    else:
-        dependencies = []
+        return getDependencies[item["type"]](item)
+    return []
+
+def getItemChecksum(item, dependencies=None):
+    if dependencies is None:
+        dependencies = getItemDependencies(item)
 
     checksumDict = {
         "item": item,
@@ -1793,12 +3707,18 @@ def writeCacheChecksumForName(itemName, checksum):
     with open(checksum_path, "w") as f:
         f.write(checksum)
 
-def isCacheValid(item, checksum):
-    checksum_path = getItemChecksumPath(item)
+def readCacheChecksumForName(itemName):
+    checksum_path = getItemChecksumPathFromName(itemName)
     if os.path.exists(checksum_path):
         with open(checksum_path, "r") as f:
-            return f.read() == checksum
-    return False
+            return f.read()
+    return None
+
+def readCacheChecksum(item):
+    return readCacheChecksumForName(item["name"])
+
+def isCacheValid(item, checksum):
+    return readCacheChecksum(item) == checksum
 
 def writeOtherChecksums(item, checksum):
     if "headers_name" in item:
@@ -1814,21 +3734,598 @@ def writeOtherChecksums(item, checksum):
         for additional_export_item in item["additional_export"]:
             writeCacheChecksumForName(additional_export_item[1], checksum)
 
+# the keys that only affect the names and location of the results, they are not taken into account in the artifact store
+ARTIFACT_KEY_IGNORED_KEYS = [
+    "name",
+    "export",
+    "modules_name",
+    "modules_export",
+    "headers_name",
+    "headers_export",
+    "result_config_name",
+    "result_config_export",
+    "architectures",
+    "forkbase",
+    "fork",
+    "forkArraysCombine",
+    "template"
+]
+
+def getArtifactKey(item, dependencies):
+    keyItem = {k: v for k, v in item.items() if k not in ARTIFACT_KEY_IGNORED_KEYS}
+    return dictChecksum({
+        "architecture": architecture,
+        "item": keyItem,
+        "dependencies": dependencies
+    })
+
+def getItemOutputs(item):
+    # all the paths that the builditem creates: [role, path, export]
+    outputs = [["main", item["name"], readBool(item, "export")]]
+    if "modules_name" in item:
+        outputs.append(["modules", item["modules_name"], readBool(item, "modules_export")])
+    if "headers_name" in item:
+        outputs.append(["headers", item["headers_name"], readBool(item, "headers_export")])
+    if "result_config_name" in item:
+        outputs.append(["result_config", item["result_config_name"], readBool(item, "result_config_export")])
+    for index, additional_export_item in enumerate(item.get("additional_export", [])):
+        outputs.append([f"additional_export_{index}", additional_export_item[1], additional_export_item[2]])
+    if item["type"] == "singleboard":
+        outputs.append(["bootdir", item["name"] + "_bootdir", False])
+        outputs.append(["bootfs", item["name"] + "_bootfs", False])
+    
+    for output in outputs:
+        output[1] = getCustomItemPath(output[1], output[2])
+    return outputs
+
+def copyArtifactPath(fromPath, toPath, hardlink):
+    # hardlinks are never used for exported results, because output rights are changed after the build
+    linkArgs = ["-l"] if hardlink else getCopyArgs(False)
+    if os.path.isdir(fromPath) and not os.path.islink(fromPath):
+        os.makedirs(toPath, exist_ok=True)
+        buildExecute(["cp", "-a"] + linkArgs + [fromPath + "/.", toPath])
+    else:
+        os.makedirs(os.path.dirname(toPath), exist_ok=True)
+        buildExecute(["cp", "-a"] + linkArgs + [fromPath, toPath])
+
+def getArtifactStorePath(key):
+    return os.path.join(args.artifact_store, key)
+
+# a remote that stops responding must not hang the build, the builditem is built locally instead
+ARTIFACT_REMOTE_TIMEOUT = 60
+
+def getArtifactRemoteUrl(key):
+    return f"{args.artifact_remote.rstrip("/")}/{key}.tar"
+
+def fetchRemoteArtifact(key):
+    # the remote artifact store is an http server that gives and accepts (PUT) tar archives of entries
+    url = getArtifactRemoteUrl(key)
+    tempPath = os.path.join(args.artifact_store, f".tmp-{key}-{os.getpid()}-{threading.get_ident()}")
+    archivePath = tempPath + ".tar"
+    deleteAny(tempPath)
+
+    try:
+        with urllib.request.urlopen(url, timeout=ARTIFACT_REMOTE_TIMEOUT) as response, open(archivePath, "wb") as f:
+            buildLog(f"Downloading artifact: {url}")
+            shutil.copyfileobj(response, f, 1024 * 1024)
+    except urllib.error.HTTPError as e:
+        deleteAny(archivePath)
+        if e.code != 404:
+            buildLog(f"WARNING: failed to download artifact ({url}): {e}")
+        return False
+    except (urllib.error.URLError, OSError) as e:
+        deleteAny(archivePath)
+        buildLog(f"WARNING: failed to download artifact ({url}): {e}")
+        return False
+
+    os.makedirs(tempPath)
+    # xattrs keep file capabilities and ACLs of the rootfs results, as cp -a does in the local store
+    buildExecute(["tar", "--numeric-owner", "--xattrs", "--xattrs-include=*", "-xpf", archivePath, "-C", tempPath])
+    deleteAny(archivePath)
+
+    with fileLock(os.path.join(args.artifact_store, ".lock")):
+        if os.path.isdir(getArtifactStorePath(key)):
+            deleteAny(tempPath)
+        else:
+            os.rename(tempPath, getArtifactStorePath(key))
+    return True
+
+def uploadRemoteArtifact(key):
+    url = getArtifactRemoteUrl(key)
+    archivePath = os.path.join(args.artifact_store, f".tmp-{key}-{os.getpid()}-{threading.get_ident()}.tar")
+    buildExecute(["tar", "--numeric-owner", "--xattrs", "--xattrs-include=*", "-cf", archivePath, "-C", getArtifactStorePath(key), "."])
+
+    try:
+        buildLog(f"Uploading artifact: {url}")
+        with open(archivePath, "rb") as f:
+            request = urllib.request.Request(url, data=f, method="PUT", headers={"Content-Length": str(os.path.getsize(archivePath))})
+            with urllib.request.urlopen(request, timeout=ARTIFACT_REMOTE_TIMEOUT):
+                pass
+    except (urllib.error.URLError, OSError) as e:
+        buildLog(f"WARNING: failed to upload artifact ({url}): {e}")
+    finally:
+        deleteAny(archivePath)
+
+def getArtifactLockPath(key):
+    return os.path.join(args.artifact_store, ".locks", key + ".lock")
+
+def getArtifactUseLockPath(key):
+    # held (shared) while the entry is copied from the store, so it is not evicted during the copy
+    return os.path.join(args.artifact_store, ".locks", key + ".use")
+
+def restoreArtifact(item, key):
+    storePath = getArtifactStorePath(key)
+    if not os.path.isfile(os.path.join(storePath, "meta.json")):
+        if not args.artifact_remote or not fetchRemoteArtifact(key):
+            return False
+
+    with fileLock(getArtifactUseLockPath(key), shared=True):
+        with fileLock(os.path.join(args.artifact_store, ".lock")):
+            if not os.path.isfile(os.path.join(storePath, "meta.json")):
+                return False
+            # the modification time of the entry is used for LRU eviction
+            os.utime(storePath)
+
+        for role, path, export in getItemOutputs(item):
+            deleteAny(path)
+            storedPath = os.path.join(storePath, "outputs", role)
+            if os.path.lexists(storedPath):
+                copyArtifactPath(storedPath, path, args.artifact_store_hardlinks and not export)
+    return True
+
+def publishArtifact(item, key):
+    storePath = getArtifactStorePath(key)
+    if os.path.isdir(storePath):
+        return
+
+    os.makedirs(args.artifact_store, exist_ok=True)
+    tempPath = os.path.join(args.artifact_store, f".tmp-{key}-{os.getpid()}-{threading.get_ident()}")
+    deleteAny(tempPath)
+    os.makedirs(os.path.join(tempPath, "outputs"))
+
+    size = 0
+    for role, path, export in getItemOutputs(item):
+        if os.path.lexists(path):
+            copyArtifactPath(path, os.path.join(tempPath, "outputs", role), args.artifact_store_hardlinks and not export)
+            size += getDiskUsage(path)
+
+    with open(os.path.join(tempPath, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump({"name": item["name"], "type": item["type"], "architecture": architecture, "size": size}, f)
+
+    # the entry appears in the store atomically, another syslbuild may have published it already
+    with fileLock(os.path.join(args.artifact_store, ".lock")):
+        if os.path.isdir(storePath):
+            deleteAny(tempPath)
+        else:
+            os.rename(tempPath, storePath)
+        evictArtifacts(key)
+
+    if args.artifact_remote:
+        uploadRemoteArtifact(key)
+
+def evictArtifacts(keepKey):
+    if not args.artifact_store_size:
+        return
+
+    limit = calcSize(args.artifact_store_size)
+    entries = []
+    total = 0
+    for entry in os.scandir(args.artifact_store):
+        metaPath = os.path.join(entry.path, "meta.json")
+        if entry.name.startswith(".") or not os.path.isfile(metaPath):
+            continue
+        with open(metaPath, "r", encoding="utf-8") as f:
+            size = json.load(f)["size"]
+        entries.append((entry.stat().st_mtime, entry.name, size))
+        total += size
+
+    for mtime, key, size in sorted(entries):
+        if total <= limit:
+            break
+        if key == keepKey:
+            continue
+        # the entry is being copied by another builditem or build agent
+        with fileLock(getArtifactUseLockPath(key), blocking=False) as locked:
+            if not locked:
+                continue
+            buildLog(f"Artifact store: deleting the least recently used entry {key} ({formatBytes(size)})")
+            deleteAny(getArtifactStorePath(key))
+        total -= size
+
+# the history of builditems builds is used to estimate the build time and size (--plan)
+itemsHistory = {}
+itemsHistoryLock = threading.Lock()
+buildTimestamp = None
+
+# the number of the last builds that are kept in the history
+HISTORY_BUILDS_LIMIT = 50
+HISTORY_COMMANDS_LIMIT = 20
+
+def readBuildHistory():
+    # records with the "kind" "build" describe the entire build, the rest describe builditems
+    records = []
+    if os.path.isfile(path_build_history):
+        with open(path_build_history, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    pass
+    return records
+
+def getHistoryBuilds(records):
+    builds = []
+    for record in records:
+        if record["build"] not in builds:
+            builds.append(record["build"])
+    return builds
+
+def trimBuildHistory():
+    records = readBuildHistory()
+    builds = getHistoryBuilds(records)
+    if len(builds) > HISTORY_BUILDS_LIMIT:
+        keepBuilds = set(builds[-HISTORY_BUILDS_LIMIT:])
+        with open(path_build_history, "w", encoding="utf-8") as f:
+            for record in records:
+                if record["build"] in keepBuilds:
+                    f.write(json.dumps(record) + "\n")
+
+def loadItemsHistory():
+    global itemsHistory
+    
+    # the last real (not cached) build of each builditem
+    itemsHistory = {}
+    for record in readBuildHistory():
+        if record.get("kind", "item") == "item" and not record["cached"]:
+            itemsHistory[record["name"]] = record
+
+def writeHistoryRecord(record):
+    with itemsHistoryLock:
+        with open(path_build_history, "a", encoding="utf-8") as f:
+            f.write(json.dumps(record) + "\n")
+
+def writeItemHistory(item, checksum, cached, duration, size, commands=None, restored=False):
+    record = {
+        "build": buildTimestamp,
+        "name": item["name"],
+        "type": item["type"],
+        "export": readBool(item, "export"),
+        "checksum": checksum,
+        "cached": cached,
+        "restored": restored,
+        "duration": round(duration, 3),
+        "size": size,
+        "commands": sorted(commands or [], key=lambda command: command["duration"], reverse=True)[:HISTORY_COMMANDS_LIMIT]
+    }
+
+    writeHistoryRecord(record)
+    if not cached:
+        with itemsHistoryLock:
+            itemsHistory[item["name"]] = record
+
+def restoreItemArtifact(item, checksum, artifactKey):
+    releaseItemLayer(item)
+    if not restoreArtifact(item, artifactKey):
+        return False
+
+    buildItemLog(item, None, " (artifact store)")
+    writeCacheChecksum(item, checksum)
+    writeOtherChecksums(item, checksum)
+    writeItemManifests(item, checksum)
+    emitBuildEvent("item-cached", architecture=architecture, name=item["name"], type=item["type"])
+    writeItemHistory(item, checksum, True, 0, None, None, True)
+    return True
+
+def rawBuildItem(item, checksum, artifactKey):
+    startTime = time.monotonic()
+    itemPath = getItemPath(item)
+    buildThreadContext.itemCommands = []
+    deleteItemManifests(item)
+    releaseItemLayer(item)
+    deleteAny(itemPath)
+    buildItemLog(item)
+    emitBuildEvent("item-start", architecture=architecture, name=item["name"], type=item["type"])
+    try:
+        buildActions.get(item["type"], buildUnknown)(item)
+    finally:
+        commands = buildThreadContext.itemCommands
+        buildThreadContext.itemCommands = None
+    writeCacheChecksum(item, checksum)
+    writeOtherChecksums(item, checksum)
+    writeItemManifests(item, checksum)
+    writeItemHistory(item, checksum, False, time.monotonic() - startTime, getDiskUsage(itemPath), commands)
+    if artifactKey:
+        publishArtifact(item, artifactKey)
+    emitBuildEvent("item-done", architecture=architecture, name=item["name"], type=item["type"])
+
+def buildItem(item):
+    dependencies = getItemDependencies(item)
+    checksum = getItemChecksum(item, dependencies)
+    artifactKey = getArtifactKey(item, dependencies) if args.artifact_store else None
+    if isCacheValid(item, checksum) and not args.n:
+        buildItemLog(item, None, " (cache)")
+        emitBuildEvent("item-cached", architecture=architecture, name=item["name"], type=item["type"])
+        writeItemHistory(item, checksum, True, 0, None)
+    elif artifactKey:
+        # while the result is being built, other threads, processes and build agents wait for it instead of building the same thing
+        with fileLock(getArtifactLockPath(artifactKey)):
+            if args.n or not restoreItemArtifact(item, checksum, artifactKey):
+                rawBuildItem(item, checksum, artifactKey)
+    else:
+        rawBuildItem(item, checksum, None)
+
+def collectReferences(fieldValue, references):
+    if isinstance(fieldValue, str):
+        references.append(fieldValue)
+    elif isinstance(fieldValue, list):
+        for inlineFieldValue in fieldValue:
+            collectReferences(inlineFieldValue, references)
+
+def getItemReferences(item):
+    references = []
+    for fieldName in dependenciesItemsFields.get(item["type"], []):
+        if fieldName in item:
+            collectReferences(item[fieldName], references)
+
+    bootloaderInfo = item.get("bootloader")
+    if isinstance(bootloaderInfo, dict):
+        if "config" in bootloaderInfo:
+            references.append(bootloaderInfo["config"])
+        for binary in bootloaderInfo.get("binaries", []):
+            references.append(binary["file"])
+
+    return references
+
+def getItemProducedNames(item):
+    names = [item["name"]]
+    for fieldName in ["headers_name", "modules_name", "result_config_name"]:
+        if fieldName in item:
+            names.append(item[fieldName])
+
+    for additional_export_item in item.get("additional_export", []):
+        names.append(additional_export_item[1])
+
+    if item["type"] == "singleboard":
+        names.append(item["name"] + "_bootdir")
+        names.append(item["name"] + "_bootfs")
+
+    return names
+
+def normalizeItemReference(reference):
+    return os.path.normpath(reference).lstrip("/")
+
+def getItemsGraph(builditems):
+    # builditems can only depend on the builditems declared before them, so the graph never has cycles
+    producers = {}
+    graph = []
+    for index, item in enumerate(builditems):
+        dependencies = set()
+        for reference in getItemReferences(item):
+            # a reference can point to a path inside another builditem: "rootfs/boot/vmlinuz"
+            referencePath = normalizeItemReference(reference)
+            while referencePath and referencePath != ".":
+                if referencePath in producers:
+                    dependencies.add(producers[referencePath])
+                    break
+                referencePath = os.path.dirname(referencePath)
+        graph.append(dependencies)
+
+        for name in getItemProducedNames(item):
+            producers[normalizeItemReference(name)] = index
+
+    return graph
+
+def getItemWeight(item):
+    # the duration of the last build, builditems that have never been built are considered short
+    record = itemsHistory.get(item["name"])
+    if record:
+        return max(record["duration"], 1)
+    return 1
+
+def getCriticalPathPriorities(builditems, graph):
+    # the priority of the builditem is the length of the longest chain of builditems that is waiting for it
+    priorities = [0] * len(builditems)
+    for index in reversed(range(len(builditems))):
+        priorities[index] += getItemWeight(builditems[index])
+        for dependency in graph[index]:
+            priorities[dependency] = max(priorities[dependency], priorities[index])
+    return priorities
+
+def buildItemsParallel(builditems, jobs):
+    graph = getItemsGraph(builditems)
+    priorities = getCriticalPathPriorities(builditems, graph)
+
+    dependents = [[] for _ in builditems]
+    waitCount = []
+    for index, dependencies in enumerate(graph):
+        waitCount.append(len(dependencies))
+        for dependency in dependencies:
+            dependents[dependency].append(index)
+
+    ready = []
+    for index in range(len(builditems)):
+        if waitCount[index] == 0:
+            heapq.heappush(ready, (-priorities[index], index))
+
+    condition = threading.Condition()
+    finished = []
+    failed = []
+    threads = []
+    freeWorkers = [f"worker{i}" for i in range(jobs, 0, -1)]
+    running = 0
+
+    def worker(index, workerName):
+        item = builditems[index]
+        buildThreadContext.workerName = workerName
+        buildThreadContext.itemName = item["name"]
+        success = False
+        try:
+            buildItem(item)
+            success = True
+        except SystemExit:
+            pass
+        except BaseException:
+            buildLog(f"ERROR: unexpected error while building the item:\n{traceback.format_exc()}")
+
+        with condition:
+            finished.append((index, workerName, success))
+            condition.notify()
+
+    buildLog(f"Building items in {jobs} jobs")
+    with condition:
+        while True:
+            while finished:
+                index, workerName, success = finished.pop()
+                running -= 1
+                freeWorkers.append(workerName)
+                if success:
+                    for dependent in dependents[index]:
+                        waitCount[dependent] -= 1
+                        if waitCount[dependent] == 0:
+                            heapq.heappush(ready, (-priorities[dependent], dependent))
+                else:
+                    failed.append(builditems[index])
+
+            # after the first error, we only wait for the builditems that are already running
+            if not failed:
+                while ready and freeWorkers:
+                    _, index = heapq.heappop(ready)
+                    thread = threading.Thread(target=worker, args=(index, freeWorkers.pop()), daemon=True)
+                    threads.append(thread)
+                    running += 1
+                    thread.start()
+
+            if running == 0:
+                break
+            condition.wait()
+
+    for thread in threads:
+        thread.join()
+
+    if failed:
+        for item in failed:
+            buildItemLog(item, "ERROR: failed to build item ", None, True)
+        sys.exit(1)
+
+def planItems(builditems):
+    graph = getItemsGraph(builditems)
+    plan = []
+    for index, item in enumerate(builditems):
+        checksum = getItemChecksum(item)
+        oldChecksum = readCacheChecksum(item)
+
+        reason = None
+        if args.n:
+            reason = "the cache is disabled"
+        elif oldChecksum is None:
+            reason = "has never been built"
+        elif oldChecksum != checksum:
+            reason = "the builditem or its dependencies have changed"
+        else:
+            for dependency in sorted(graph[index]):
+                if plan[dependency]["rebuild"]:
+                    # the builditem will not be rebuilt if the dependency produces the same result (early cutoff)
+                    reason = f"depends on the rebuilt builditem \"{builditems[dependency]["name"]}\" (if its result changes)"
+                    break
+
+        record = itemsHistory.get(item["name"])
+        plan.append({
+            "architecture": architecture,
+            "index": item["__item_index"],
+            "count": item["__items_count"],
+            "name": item["name"],
+            "type": item["type"],
+            "export": readBool(item, "export"),
+            "checksum": checksum,
+            "rebuild": reason is not None,
+            "reason": reason,
+            "estimatedDuration": record["duration"] if record else None,
+            "estimatedSize": record["size"] if record else None
+        })
+
+    # the longest chain of the rebuilt builditems, this is the build time with an unlimited number of jobs
+    chains = []
+    for index, entry in enumerate(plan):
+        chain = 0
+        for dependency in graph[index]:
+            chain = max(chain, chains[dependency])
+        if entry["rebuild"]:
+            chain += entry["estimatedDuration"] or 0
+        chains.append(chain)
+        entry["estimatedChainDuration"] = chain
+
+    return plan
+
+def getPlanSummary(plan):
+    summary = {
+        "items": len(plan),
+        "rebuild": 0,
+        "unknown": 0,
+        "duration": 0,
+        "criticalPathDuration": 0,
+        "tempSize": 0,
+        "outputSize": 0
+    }
+
+    for entry in plan:
+        summary["criticalPathDuration"] = max(summary["criticalPathDuration"], entry["estimatedChainDuration"])
+        if not entry["rebuild"]:
+            continue
+
+        summary["rebuild"] += 1
+        if entry["estimatedDuration"] is None:
+            summary["unknown"] += 1
+            continue
+
+        summary["duration"] += entry["estimatedDuration"]
+        if entry["export"]:
+            summary["outputSize"] += entry["estimatedSize"] or 0
+        else:
+            summary["tempSize"] += entry["estimatedSize"] or 0
+
+    return summary
+
+def showPlan(plan):
+    for entry in plan:
+        itemStr = f"{entry["index"]}/{entry["count"]} {entry["type"]} ({entry["name"]}){" (export)" if entry["export"] else ""}"
+        if entry["rebuild"]:
+            if entry["estimatedDuration"] is None:
+                estimateStr = "no data from previous builds"
+            else:
+                estimateStr = f"~{formatDuration(entry["estimatedDuration"])}, ~{formatBytes(entry["estimatedSize"] or 0)}"
+            buildLog(f"Rebuild: {itemStr} - {entry["reason"]} ({estimateStr})")
+        else:
+            buildLog(f"Cache: {itemStr}")
+
+    summary = getPlanSummary(plan)
+    buildLog(f"Builditems to rebuild: {summary["rebuild"]}/{summary["items"]}")
+    if summary["rebuild"] > 0:
+        buildLog(f"Estimated build time: {formatDuration(summary["duration"])} (with one job), {formatDuration(summary["criticalPathDuration"])} (critical path)")
+        buildLog(f"Estimated size of the rebuilt builditems: {formatBytes(summary["tempSize"])} in {path_temp}, {formatBytes(summary["outputSize"])} in {path_output}")
+        if summary["unknown"] > 0:
+            buildLog(f"WARNING: {summary["unknown"]} builditems have never been built, they are not included in the estimates")
+
+        tempFree = shutil.disk_usage(path_temp).free
+        outputFree = shutil.disk_usage(path_output).free
+        buildLog(f"Free space: {formatBytes(tempFree)} in {path_temp}, {formatBytes(outputFree)} in {path_output}")
+        if os.stat(path_temp).st_dev == os.stat(path_output).st_dev:
+            if summary["tempSize"] + summary["outputSize"] > tempFree:
+                buildLog("WARNING: there may not be enough disk space for the build")
+        elif summary["tempSize"] > tempFree or summary["outputSize"] > outputFree:
+            buildLog("WARNING: there may not be enough disk space for the build")
+    buildLog(";")
+
+    return summary
+
 def buildItems(builditems):
+    if args.jobs > 1:
+        buildItemsParallel(builditems, args.jobs)
+    else:
+        for item in builditems:
+            buildItem(item)
+
     exported = []
-        
     for item in builditems:
-        itemPath = getItemPath(item)
-        checksum = getItemChecksum(item)
-        if isCacheValid(item, checksum) and not args.n:
-            buildItemLog(item, None, " (cache)")
-        else:
-            deleteAny(itemPath)
-            buildItemLog(item)
-            buildActions.get(item["type"], buildUnknown)(item)
-            writeCacheChecksum(item, checksum)
-            writeOtherChecksums(item, checksum)
-        
         if readBool(item, "export"):
             exported.append(item)
     
@@ -1843,9 +4340,11 @@ def showProjectInfo(projectData):
     buildLog(";")
 
 def cleanup():
-    recursionUmount(path_temp)
-    umountFilesystem(path_mount)
-    umountFilesystem(path_mount2)
+    recursionUmount(path_temp_architecture)
+    mountedLayers.clear()
+    # the loop devices of all mount points, including the mount points of the --jobs workers
+    for mount_path in list(mountLoops) + [path_mount, path_mount2]:
+        umountFilesystem(mount_path)
     deleteDirectory(path_temp_temp)
 
 def prepairBuild():
@@ -1899,12 +4398,11 @@ def includeProcess(builditems, included=None):
                         sys.exit(1)
                     included.append(includeFilePath)
 
-                    with open(includeFilePath, "r", encoding="utf-8") as f:
-                        newLocalBuilditems = json5.load(f)
-                        if not isinstance(newLocalBuilditems, list):
-                            buildLog(f"there is no \"{includeFilePath}\" array in the root of the attached file")
-                            sys.exit(1)
-                        newBuilditems.extend(newLocalBuilditems)
+                    newLocalBuilditems = loadJsonFile(includeFilePath)
+                    if not isinstance(newLocalBuilditems, list):
+                        buildLog(f"there is no \"{includeFilePath}\" array in the root of the attached file")
+                        sys.exit(1)
+                    newBuilditems.extend(newLocalBuilditems)
             else:
                 newBuilditems.append(builditem)
 
@@ -1943,18 +4441,15 @@ def prepairBuildItems(builditems):
 
     return builditems
 
-def buildProject(json_path):
-    with open(json_path, "r", encoding="utf-8") as f:
-        projectData = json5.load(f)
+def loadBuildItems(json_path):
+    global checksumAlgorithm
 
-    buildLog(f"Build for architecture: {architecture}")
-    builditems = projectData["builditems"]
-    cleanup()
-    prepairBuild()
-    builditems = prepairBuildItems(builditems)
+    projectData = loadJsonFile(json_path)
+    checksumAlgorithm = projectData.get("checksum-algorithm", "sha256")
+    newHash(checksumAlgorithm)
+    builditems = prepairBuildItems(projectData["builditems"])
 
     namesExists = []
-    buildLog("Item list:")
     for item in builditems:
         if "name" not in item:
             buildLog(f"ERROR: builditem without a name")
@@ -1963,19 +4458,383 @@ def buildProject(json_path):
             buildLog(f"ERROR: builditem without a type")
             sys.exit(1)
         elif item["name"] not in namesExists:
-            buildItemLog(item)
             namesExists.append(item["name"])
         else:
             buildLog(f"ERROR: more than one builditem named {item["name"]}")
             sys.exit(1)
+
+    return builditems
+
+def buildProject(json_path):
+    global buildTimestamp
+
+    buildLog(f"Build for architecture: {architecture}")
+    cleanup()
+    prepairBuild()
+    trimBuildHistory()
+    loadItemsHistory()
+    loadFileHashIndex()
+    buildTimestamp = datetime.datetime.now().isoformat(timespec="seconds")
+    buildStartTime = time.monotonic()
+    builditems = loadBuildItems(json_path)
+
+    buildLog("Item list:")
+    for item in builditems:
+        buildItemLog(item)
     buildLog(";")
     
-    exported = buildItems(builditems)
+    try:
+        exported = buildItems(builditems)
+    finally:
+        umountLayers()
+        saveFileHashIndex()
+    writeHistoryRecord({"kind": "build", "build": buildTimestamp, "duration": round(time.monotonic() - buildStartTime, 3)})
     buildLog("The build was successful. export list:")
     for exportedItem in exported:
         buildItemLog(exportedItem, "Exported: ", None, True)
     buildLog(";")
 
+def planProject(json_path):
+    prepairBuild()
+    loadItemsHistory()
+    loadFileHashIndex()
+    try:
+        return planItems(loadBuildItems(json_path))
+    finally:
+        umountLayers()
+        saveFileHashIndex()
+
+REPORT_ITEMS_LIMIT = 10
+REPORT_BUILDS_LIMIT = 10
+
+def getCriticalPath(builditems, graph):
+    # the chain of dependent builditems with the longest total duration of the last real builds
+    chains = []
+    previous = []
+    for index, item in enumerate(builditems):
+        record = itemsHistory.get(item["name"])
+        longestDependency = None
+        for dependency in graph[index]:
+            if longestDependency is None or chains[dependency] > chains[longestDependency]:
+                longestDependency = dependency
+        chains.append((chains[longestDependency] if longestDependency is not None else 0) + (record["duration"] if record else 0))
+        previous.append(longestDependency)
+
+    if not chains:
+        return [], 0
+
+    index = max(range(len(chains)), key=lambda i: chains[i])
+    total = chains[index]
+    path = []
+    while index is not None:
+        path.append(builditems[index])
+        index = previous[index]
+    path.reverse()
+    return path, total
+
+def showReport(builditems):
+    records = readBuildHistory()
+    itemRecords = [record for record in records if record.get("kind", "item") == "item"]
+    recentBuilds = getHistoryBuilds(records)[-REPORT_BUILDS_LIMIT:]
+    recentItemRecords = [record for record in itemRecords if record["build"] in recentBuilds]
+    loadItemsHistory()
+
+    if not itemRecords:
+        buildLog("there is no build history for this architecture yet")
+        buildLog(";")
+        return
+
+    buildLog("Slowest builditems (last real build):")
+    slowest = sorted(itemsHistory.values(), key=lambda record: record["duration"], reverse=True)[:REPORT_ITEMS_LIMIT]
+    for record in slowest:
+        buildLog(f"{formatDuration(record["duration"])} - {record["type"]} ({record["name"]}), {formatBytes(record["size"] or 0)}, built {record["build"]}")
+        for command in record.get("commands", [])[:3]:
+            buildLog(f"    {formatDuration(command["duration"])} - {command["command"]}", True)
+    buildLog(";")
+
+    path, total = getCriticalPath(builditems, getItemsGraph(builditems))
+    buildLog(f"Critical path ({formatDuration(total)}):")
+    for item in path:
+        record = itemsHistory.get(item["name"])
+        buildLog(f"{formatDuration(record["duration"]) if record else "no data"} - {item["type"]} ({item["name"]})")
+    buildLog(";")
+
+    hits = len([record for record in recentItemRecords if record["cached"]])
+    buildLog(f"Cache hit rate for the last {len(recentBuilds)} builds: {hits}/{len(recentItemRecords)} ({round(hits * 100 / max(len(recentItemRecords), 1))}%)")
+    misses = {}
+    for record in recentItemRecords:
+        if not record["cached"]:
+            misses[record["name"]] = misses.get(record["name"], 0) + 1
+    for name, count in sorted(misses.items(), key=lambda pair: pair[1], reverse=True)[:REPORT_ITEMS_LIMIT]:
+        buildLog(f"rebuilt {count} times: {name}")
+    buildLog(";")
+
+    buildLog("Recent builds:")
+    for build in recentBuilds:
+        buildRecords = [record for record in recentItemRecords if record["build"] == build]
+        rebuilt = [record for record in buildRecords if not record["cached"]]
+        wallDurations = [record["duration"] for record in records if record.get("kind") == "build" and record["build"] == build]
+        wallStr = formatDuration(wallDurations[0]) if wallDurations else "not finished"
+        buildLog(f"{build}: {wallStr}, rebuilt {len(rebuilt)}/{len(buildRecords)}, builditems time {formatDuration(sum(record["duration"] for record in rebuilt))}")
+    buildLog(";")
+
+def runReport(json_path):
+    # --report: shows the statistics from .temp/<arch>/build_history.jsonl, nothing is being built
+    global architecture
+
+    projectData = loadJsonFile(json_path)
+    for arch in getProjectArchitectures(projectData):
+        architecture = arch
+        loadTempPaths()
+        prepairBuild()
+        buildLog(f"Build report for architecture: {architecture}")
+        showReport(loadBuildItems(json_path))
+
+def runPlan(json_path):
+    # --plan: calculates the checksums of all builditems and shows what will be rebuilt, nothing is being built
+    global architecture
+
+    projectData = loadJsonFile(json_path)
+    result = {}
+    for arch in getProjectArchitectures(projectData):
+        architecture = arch
+        loadTempPaths()
+        buildLog(f"Build plan for architecture: {architecture}")
+        plan = planProject(json_path)
+        summary = showPlan(plan)
+        result[arch] = {"items": plan, "summary": summary}
+
+    if args.plan_json:
+        with open(args.plan_json, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+def getProjectArchitectures(projectData):
+    if architecture == "ALL":
+        return projectData.get("architectures", [])
+    return [architecture]
+
+def runBuild(json_path):
+    global architecture, runStartTime
+
+    # the --parallel-arch processes get the start time of the main process, so -d downloads the sources once for the whole build
+    runStartTime = float(os.environ.get("SYSLBUILD_RUN_START", time.time()))
+    projectData = loadJsonFile(json_path)
+    showProjectInfo(projectData)
+    if not checkVersion(projectData):
+        buildLog(f"ERROR: the project requires at least the syslbuild {formatVersion(projectData["min-syslbuild-version"])} version. you have {formatVersion(VERSION)} installed")
+        sys.exit(1)
+
+    if architecture == "ALL":
+        if "architectures" in projectData:
+            buildLog("build for the following list of architectures:")
+            for arch in projectData["architectures"]:
+                buildLog(arch)
+            buildLog(";")
+            
+            if args.parallel_arch:
+                buildArchitecturesParallel(json_path, projectData["architectures"])
+            else:
+                for arch in projectData["architectures"]:
+                    architecture = arch
+                    loadTempPaths()
+                    buildProject(json_path)
+        else:
+            buildLog("Architectures list is not defined in project json")
+    else:
+        loadTempPaths()
+        buildProject(json_path)
+
+    changeOutputRights(path_output)
+
+def showSyslbuildInfo():
+    buildLog("Syslbuild info:")
+    buildLog(f"Syslbuild version: {formatVersion(VERSION)}")
+    buildLog(";")
+
+def formatDuration(seconds):
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h {seconds % 3600 // 60}m {seconds % 60}s"
+    elif seconds >= 60:
+        return f"{seconds // 60}m {seconds % 60}s"
+    return f"{seconds}s"
+
+def getArchitectureBuildCommand(json_path, arch):
+    cmd = [sys.executable, os.path.abspath(__file__), "--arch", arch, "--temp", path_temp, "--output", path_output, "--jobs", str(args.jobs), "--console-lines", str(args.console_lines)]
+    if args.n:
+        cmd.append("-n")
+    if args.d:
+        cmd.append("-d")
+    if args.artifact_store:
+        cmd += ["--artifact-store", args.artifact_store]
+    if args.artifact_store_size:
+        cmd += ["--artifact-store-size", args.artifact_store_size]
+    if args.artifact_store_hardlinks:
+        cmd.append("--artifact-store-hardlinks")
+    if args.artifact_remote:
+        cmd += ["--artifact-remote", args.artifact_remote]
+    if args.apt_archive:
+        cmd += ["--apt-archive", args.apt_archive]
+    if args.debian_snapshots:
+        cmd += ["--debian-snapshots", args.debian_snapshots]
+    if args.kernel_build_size:
+        cmd += ["--kernel-build-size", args.kernel_build_size]
+    if args.cpus:
+        cmd += ["--cpus", str(args.cpus)]
+    if args.compress_logs:
+        cmd.append("--compress-logs")
+    if getattr(args, "lastlog", None):
+        # the output of all processes is already in the main lastlog, so every process writes its own lastlog next to it
+        lastlogBase, lastlogExtension = os.path.splitext(args.lastlog)
+        cmd += ["--lastlog", f"{lastlogBase}_{arch}{lastlogExtension}"]
+    cmd.append(json_path)
+    return cmd
+
+def buildArchitecturesParallel(json_path, architectures):
+    # every architecture is built by a separate syslbuild process with its own .temp/<arch> directory and log file
+    # the output of the processes is merged into the current log with the architecture prefix
+    def readProcessOutput(arch, process):
+        for line in process.stdout:
+            buildLog(f"[{arch}] {line.rstrip()}", True)
+        process.stdout.close()
+
+    processes = {}
+    readers = []
+    startTime = time.monotonic()
+    for arch in architectures:
+        # the processes share the CPU budget of this process
+        jobserverEnv = getJobserverEnv()
+        jobserverEnv["SYSLBUILD_RUN_START"] = str(runStartTime)
+        process = subprocess.Popen(
+            getArchitectureBuildCommand(json_path, arch),
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+            env={**os.environ, **jobserverEnv},
+            pass_fds=getJobserverFds(jobserverEnv)
+        )
+        processes[arch] = process
+
+        reader = threading.Thread(target=readProcessOutput, args=(arch, process), daemon=True)
+        reader.start()
+        readers.append(reader)
+
+    results = {}
+    pending = dict(processes)
+    while pending:
+        for arch, process in list(pending.items()):
+            if process.poll() is not None:
+                results[arch] = (process.returncode, time.monotonic() - startTime)
+                del pending[arch]
+        time.sleep(0.2)
+
+    for reader in readers:
+        reader.join()
+
+    buildLog("Architectures build summary:")
+    failed = False
+    for arch in architectures:
+        returncode, duration = results[arch]
+        if returncode == 0:
+            buildLog(f"{arch}: successful ({formatDuration(duration)})")
+        else:
+            buildLog(f"{arch}: FAILED with code {returncode} ({formatDuration(duration)})")
+            failed = True
+    buildLog(";")
+
+    if failed:
+        buildLog("ERROR: failed to build one or more architectures")
+        sys.exit(1)
+
+buildApiLock = threading.RLock()
+
+class Build:
+    """
+    syslbuild api for building projects without starting a new interpreter:
+
+    import syslbuild
+    build = syslbuild.Build("project.json", "amd64", ".temp", "output", eventCallback=lambda eventName, data: print(eventName, data))
+    for entry in build.plan():
+        print(entry["name"], entry["reason"])
+    build.run()
+
+    the api is serialized: the build state of syslbuild is stored in the module globals, so plan() and run() of all Build objects
+    of one process are executed one after another (a call from another thread waits for buildApiLock). Build objects are not
+    independent concurrent builds, to build several projects at the same time use separate processes.
+    parsed project files and file checksums are kept between builds.
+    events: "log" (line), "item-start", "item-cached", "item-done" (architecture, name, type)
+    """
+
+    def __init__(self, project, arch, temp=".temp", output="output", jobs=1, noCache=False, noDownloadCache=False, clearCache=False, parallelArch=False, artifactStore=None, artifactStoreSize=None, artifactStoreHardlinks=False, artifactRemote=None, aptArchive=None, debianSnapshots=None, kernelBuildSize=None, cpus=None, lastlog=None, compressLogs=False, consoleLines=DEFAULT_CONSOLE_LINES, eventCallback=None):
+        self.project = project
+        self.arch = arch
+        self.temp = temp
+        self.output = output
+        self.lastlog = lastlog
+        self.clearCache = clearCache
+        self.eventCallback = eventCallback
+        self.args = argparse.Namespace(n=noCache, d=noDownloadCache, e=clearCache, jobs=jobs, parallel_arch=parallelArch, plan=False, plan_json=None, report=False, artifact_store=artifactStore, artifact_store_size=artifactStoreSize, artifact_store_hardlinks=artifactStoreHardlinks, artifact_remote=artifactRemote, apt_archive=aptArchive, debian_snapshots=debianSnapshots, kernel_build_size=kernelBuildSize, cpus=cpus, compress_logs=compressLogs, console_lines=consoleLines)
+
+    @contextlib.contextmanager
+    def activate(self, withLog):
+        global architecture, path_temp, path_output, args, log_file, log_file2, buildEventCallback
+
+        with buildApiLock:
+            saved = (architecture, path_temp, path_output, args, log_file, log_file2, buildEventCallback)
+            architecture = self.arch
+            path_temp = self.temp
+            path_output = self.output
+            args = self.args
+            log_file = None
+            log_file2 = None
+            buildEventCallback = self.eventCallback
+            try:
+                loadTempPaths()
+                if withLog:
+                    log_file = getLogFile()
+                    if self.lastlog:
+                        log_file2 = open(self.lastlog, "w")
+                yield
+            finally:
+                flushBuildLog(True)
+                if log_file:
+                    log_file.close()
+                if log_file2:
+                    log_file2.close()
+                architecture, path_temp, path_output, args, log_file, log_file2, buildEventCallback = saved
+
+    def plan(self):
+        """returns the list of builditems with the "rebuild" flag and the reason for the rebuild"""
+        global architecture
+
+        with self.activate(False):
+            plan = []
+            for arch in getProjectArchitectures(loadJsonFile(self.project)):
+                architecture = arch
+                loadTempPaths()
+                plan += planProject(self.project)
+            return plan
+
+    def run(self):
+        """builds the project. returns True if the build was successful"""
+        with self.activate(False):
+            if self.clearCache:
+                recursionUmount(path_temp)
+                deleteAny(path_temp)
+                deleteAny(path_output)
+
+        with self.activate(True):
+            try:
+                showSyslbuildInfo()
+                runBuild(self.project)
+            except SystemExit as e:
+                return e.code in (None, 0)
+            return True
+
 def requireRoot():
     if os.geteuid() != 0:
         print("This program requires root permissions. Restarting with sudo...")
@@ -2012,9 +4871,28 @@ if __name__ == "__main__":
     parser.add_argument("--lastlog", type=str, help="additional log file")
     parser.add_argument("json_path", type=str, help="the path to the json file of the project")
     parser.add_argument("-n", action="store_true", help="does the build anew, does not use the cache")
-    parser.add_argument("-d", action="store_true", help="do not use the download cache of the kernel sources")
+    parser.add_argument("-d", action="store_true", help="do not use the download cache of the kernel sources and the apt archive")
     parser.add_argument("-e", action="store_true", help="completely clears the entire cache before building")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="the number of builditems that can be built at the same time")
+    parser.add_argument("--cpus", type=int, help="the number of CPUs that the commands of all builditems (make, gcc, compressors, chroot scripts) can use at the same time (default: all CPUs). the jobserver of the parent make is used instead, if there is one")
+    parser.add_argument("--parallel-arch", action="store_true", help="with --arch ALL, builds all architectures at the same time, each in a separate process")
+    parser.add_argument("--plan", action="store_true", help="shows which builditems will be rebuilt and estimates the build time and size without building anything")
+    parser.add_argument("--plan-json", type=str, help="with --plan, also saves the plan to the specified json file")
+    parser.add_argument("--artifact-store", type=str, help="path to a directory with builditems results, shared between projects and architectures. results are stored by the builditem content, so renamed builditems are also taken from it")
+    parser.add_argument("--artifact-store-size", type=str, help="the maximum size of the artifact store (for example 100GB), the least recently used results are deleted")
+    parser.add_argument("--artifact-remote", type=str, help="url of an http server with artifact store entries (GET/PUT URL/KEY.tar), used together with --artifact-store")
+    parser.add_argument("--artifact-store-hardlinks", action="store_true", help="use hardlinks instead of reflinks/copies for not exported results in the artifact store")
+    parser.add_argument("--apt-archive", type=str, help="path to the shared archive of .deb files for debian builditems (default: .temp/apt_archives), it can be shared between projects and build agents")
+    parser.add_argument("--debian-snapshots", type=str, help="path to the directory with the compressed snapshots of bootstrapped debian systems (default: .temp/debian_snapshots), it can be shared between projects")
+    parser.add_argument("--kernel-build-size", type=str, help="the maximum size of the patched kernel trees and their objects in .temp/ARCHITECTURE/kernel_build (for example 50GB), the least recently used trees are deleted")
+    parser.add_argument("--console-lines", type=int, default=DEFAULT_CONSOLE_LINES, help=f"the maximum number of lines of the commands output shown in the console per second (default: {DEFAULT_CONSOLE_LINES}, 0 - no limit). the log files always contain the whole output")
+    parser.add_argument("--compress-logs", action="store_true", help="compress the logs of the previous builds with gzip")
+    parser.add_argument("--report", action="store_true", help="shows the slowest builditems, the critical path, the cache hit rate and the recent builds from the build history")
     args = parser.parse_args()
+
+    if args.artifact_remote and not args.artifact_store:
+        print("--artifact-remote requires --artifact-store (it is used as a local copy of the remote entries)")
+        sys.exit(1)
     
     requireRoot()
 
@@ -2027,6 +4905,7 @@ if __name__ == "__main__":
     architecture = args.arch
     loadTempPaths()
     if args.e:
+        recursionUmount(path_temp)
         deleteAny(path_temp)
         deleteAny(path_output)
     log_file = getLogFile()
@@ -2036,33 +4915,10 @@ if __name__ == "__main__":
     else:
         log_file2 = None
 
-    buildLog("Syslbuild info:")
-    buildLog(f"Syslbuild version: {formatVersion(VERSION)}")
-    buildLog(";")
-
-    with open(args.json_path, "r", encoding="utf-8") as f:
-        projectData = json5.load(f)
-        showProjectInfo(projectData)
-        if not checkVersion(projectData):
-            buildLog(f"ERROR: the project requires at least the syslbuild {formatVersion(projectData["min-syslbuild-version"])} version. you have {formatVersion(VERSION)} installed")
-            sys.exit(1)
-
-        if architecture == "ALL":
-            if "architectures" in projectData:
-                buildLog("build for the following list of architectures:")
-                for arch in projectData["architectures"]:
-                    buildLog(arch)
-                buildLog(";")
-                
-                for arch in projectData["architectures"]:
-                    architecture = arch
-                    loadTempPaths()
-                    buildProject(args.json_path)
-            else:
-                buildLog("Architectures list is not defined in project json")
-        else:
-            loadTempPaths()
-            buildProject(args.json_path)
-
-    changeOutputRights(path_output)
-    
+    showSyslbuildInfo()
+    if args.plan:
+        runPlan(args.json_path)
+    elif args.report:
+        runReport(args.json_path)
+    else:
+        runBuild(args.json_path)
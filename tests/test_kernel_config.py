@@ -0,0 +1,39 @@
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import syslbuild
+
+def write_config(tmp_path, text):
+    config_path = str(tmp_path / ".config")
+    with open(config_path, "w") as f:
+        f.write(text)
+    return config_path
+
+def read_config(config_path):
+    with open(config_path) as f:
+        return f.read()
+
+def test_disable_missing_symbol(tmp_path, monkeypatch):
+    monkeypatch.setattr(syslbuild, "buildLog", lambda *args: None)
+    config_path = write_config(tmp_path, "CONFIG_PARENT=y\n")
+
+    changed = syslbuild.apply_kernel_config_changes(config_path, [["CONFIG_CHILD", "n", "fragment"], ["CONFIG_OTHER", None, "fragment"]])
+
+    assert changed == ["CONFIG_CHILD", "CONFIG_OTHER"]
+    assert read_config(config_path) == "CONFIG_PARENT=y\n# CONFIG_CHILD is not set\n# CONFIG_OTHER is not set\n"
+
+def test_changes_applied_in_order(tmp_path, monkeypatch):
+    monkeypatch.setattr(syslbuild, "buildLog", lambda *args: None)
+    config_path = write_config(tmp_path, "# comment\nCONFIG_A=y\n# CONFIG_B is not set\n")
+
+    changed = syslbuild.apply_kernel_config_changes(config_path, [["CONFIG_A", "n", "first"], ["CONFIG_A", "y", "second"], ["CONFIG_B", "y", "first"], ["CONFIG_C", "m", "first"]])
+
+    assert changed == ["CONFIG_B", "CONFIG_C"]
+    assert read_config(config_path) == "# comment\nCONFIG_A=y\nCONFIG_B=y\nCONFIG_C=m\n"
+
+def test_unchanged_config_is_not_written(tmp_path, monkeypatch):
+    monkeypatch.setattr(syslbuild, "buildLog", lambda *args: None)
+    config_path = write_config(tmp_path, "CONFIG_A=y\n# CONFIG_B is not set\n")
+
+    assert syslbuild.apply_kernel_config_changes(config_path, [["CONFIG_A", "y", "fragment"], ["CONFIG_B", "n", "fragment"]]) == []